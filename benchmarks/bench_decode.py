@@ -0,0 +1,77 @@
+"""Per-format decode benchmark: decode.open_for_screen vs the previous decode path.
+
+Each (format, resolution, method) case runs in a fresh process so its peak
+RSS can be measured in isolation.
+
+    python benchmarks/bench_decode.py --screen 1600x1200 --repeat 5 --out bench_decode.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import multiprocessing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+sys.path.insert(0, HERE)
+
+import decode  # noqa: E402
+from corpus import build_corpus  # noqa: E402
+from common import peak_rss_kb  # noqa: E402
+
+METHODS = {"legacy": decode.open_legacy, "open_for_screen": decode.open_for_screen}
+
+
+def _run_case(args):
+    method, path, screen, repeat = args
+    fn = METHODS[method]
+    rss_before = peak_rss_kb()
+    times = []
+    route = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        im = fn(path, screen)
+        times.append((time.perf_counter() - start) * 1000)
+        route = im.info.get("decode_route")
+    rss_after = peak_rss_kb()
+    return {
+        "median_ms": round(statistics.median(times), 1),
+        "min_ms": round(min(times), 1),
+        "peak_rss_kb": rss_after,
+        "peak_rss_delta_kb": rss_after - rss_before,
+        "route": route,
+        "output_size": list(im.size),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(HERE, ".corpus"))
+    parser.add_argument("--screen", default="1600x1200")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default="bench_decode.json")
+    args = parser.parse_args()
+    screen = tuple(int(v) for v in args.screen.split("x"))
+
+    paths = build_corpus(args.corpus, per_case=1)
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for path in paths:
+        for method in METHODS:
+            # maxtasksperchild=1: a fresh process per case keeps the RSS numbers separate
+            with ctx.Pool(1, maxtasksperchild=1) as pool:
+                result = pool.apply(_run_case, ((method, path, screen, args.repeat),))
+            result.update(file=os.path.basename(path), method=method)
+            results.append(result)
+            print(f"{result['file']:28} {method:16} {result['median_ms']:8.1f} ms "
+                  f"peak RSS +{result['peak_rss_delta_kb'] / 1024:6.1f} MB  route={result['route']}")
+
+    with open(args.out, "w") as f:
+        json.dump({"screen": list(screen), "repeat": args.repeat, "results": results}, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
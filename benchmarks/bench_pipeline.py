@@ -0,0 +1,272 @@
+"""End-to-end benchmark of the frame's image pipeline, headless.
+
+Runs the frame's real code under SDL's dummy video driver against the
+generated corpus:
+
+- per-stage latency: _create_thumbnail (decode + write), _load_surface_from_thumbnail,
+  scale_to_screen and render_image (what display_image draws)
+- a simulated navigation trace (mostly forward, some back taps) through the
+  real Prefetcher / SurfaceCache, reporting display latency and hit rates,
+  first with an empty thumbnail cache, then with a warm one
+- requests per second of the web manager's /thumb endpoint (Flask test client),
+  cold, warm and as 304 revalidations
+- peak RSS of each run
+
+Every screen size and the web run get a fresh process, so their peak RSS is
+measured in isolation. Results go to a JSON file so runs can be compared.
+
+    python benchmarks/bench_pipeline.py --screens 800x480,1920x1080 --out bench_pipeline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+sys.path.insert(0, HERE)
+
+from corpus import build_corpus  # noqa: E402
+from common import peak_rss_kb, percentiles, load_frame, use_scratch_cache  # noqa: E402
+
+TRACE_STEPS = 60
+TRACE_BACK_SHARE = 0.2   # share of navigation steps that go back instead of forward
+TRACE_DWELL = 0.25       # seconds between taps; shorter leaves the prefetcher less time
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _format_of(path):
+    return os.path.basename(path).split("-", 1)[0]
+
+
+def _stage_timings(frame, screen, paths, repeat):
+    import pygame
+    size = screen.get_size()
+    stages = {name: [] for name in ("create_thumbnail", "load_surface", "scale_to_screen", "render")}
+    by_format = {}
+    for path in paths:
+        thumb = frame._thumbnail_path_for(path, size)
+        for _ in range(repeat):
+            if os.path.exists(thumb):
+                os.remove(thumb)
+            _, create_ms = _timed(frame._create_thumbnail, path, thumb, size)
+            surface, load_ms = _timed(frame._load_surface_from_thumbnail, thumb)
+            _, scale_ms = _timed(frame.scale_to_screen, surface, size)
+            _, render_ms = _timed(frame.render_image, screen, surface)
+            for name, ms in (("create_thumbnail", create_ms), ("load_surface", load_ms),
+                             ("scale_to_screen", scale_ms), ("render", render_ms)):
+                stages[name].append(ms)
+            by_format.setdefault(_format_of(path), []).append(create_ms)
+            pygame.event.pump()
+    return ({name: percentiles(samples) for name, samples in stages.items()},
+            {fmt: percentiles(samples) for fmt, samples in by_format.items()})
+
+
+def _navigation_trace(length, playlist_size, back_share, seed=0):
+    # Playlist positions visited by a viewer tapping mostly forward
+    rng = random.Random(seed)
+    position, trace = 0, [0]
+    for _ in range(length - 1):
+        if position > 0 and rng.random() < back_share:
+            position -= 1
+        else:
+            position = (position + 1) % playlist_size
+        trace.append(position)
+    return trace
+
+
+def _run_trace(frame, screen, playlist, trace, dwell):
+    # Mirrors display_image + schedule_prefetch: show from the surface cache if
+    # possible, otherwise load synchronously, then queue the neighbours
+    size = screen.get_size()
+    frame.surface_cache = frame.SurfaceCache(frame.SURFACE_CACHE_BYTES)
+    prefetcher = frame.Prefetcher(size)
+    latencies = []
+    thumb_hits = thumb_misses = 0
+    for position in trace:
+        path = playlist[position]
+        start = time.perf_counter()
+        surface = frame.surface_cache.get(path)
+        if surface is None:
+            if os.path.exists(frame._thumbnail_path_for(path, size)):
+                thumb_hits += 1
+            else:
+                thumb_misses += 1
+            surface = frame._load_display_surface(path, size)
+        frame.render_image(screen, surface)
+        latencies.append((time.perf_counter() - start) * 1000)
+        n = len(playlist)
+        ahead = [playlist[(position + i) % n] for i in range(1, frame.PREFETCH_COUNT + 1)]
+        behind = [playlist[position - i] for i in range(1, frame.PREFETCH_BACK_COUNT + 1) if position - i >= 0]
+        prefetcher.schedule(ahead + behind)
+        time.sleep(dwell)
+
+    stats = frame.surface_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    thumb_lookups = thumb_hits + thumb_misses
+    return {
+        "display_ms": percentiles(latencies),
+        "surface_hit_rate": round(stats["hits"] / lookups, 3) if lookups else None,
+        "thumbnail_hit_rate": round(thumb_hits / thumb_lookups, 3) if thumb_lookups else None,
+        "surface_cache": stats,
+    }
+
+
+def _run_screen(args):
+    screen_size, paths, repeat, dwell, steps = args
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline-")
+    try:
+        use_scratch_cache(work_dir)
+        frame = load_frame()
+        import pygame
+        from disk_cache import DiskCache
+
+        pygame.init()
+        screen = pygame.display.set_mode(screen_size)
+        rss_before = peak_rss_kb()
+        stages, create_by_format = _stage_timings(frame, screen, paths, repeat)
+
+        shutil.rmtree(frame.CACHE_DIR)
+        os.makedirs(frame.CACHE_DIR)
+        frame.thumb_cache = DiskCache(frame.CACHE_DIR, frame.THUMB_CACHE_MAX_BYTES)
+        playlist = list(paths)
+        random.Random(1).shuffle(playlist)
+        trace = _navigation_trace(steps, len(playlist), TRACE_BACK_SHARE)
+        cold = _run_trace(frame, screen, playlist, trace, dwell)
+        warm = _run_trace(frame, screen, playlist, trace, dwell)
+        pygame.quit()
+        rss_after = peak_rss_kb()
+        return {
+            "screen": list(screen_size),
+            "stages_ms": stages,
+            "create_thumbnail_by_format_ms": create_by_format,
+            "navigation": {"steps": steps, "dwell_seconds": dwell, "cold": cold, "warm": warm},
+            "peak_rss_kb": rss_after,
+            "peak_rss_delta_kb": rss_after - rss_before,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _throughput(client, urls, headers=None):
+    start = time.perf_counter()
+    statuses = {}
+    for url in urls:
+        status = client.get(url, headers=headers or {}).status_code
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - start
+    return {"requests": len(urls), "requests_per_second": round(len(urls) / elapsed, 1),
+            "statuses": {str(k): v for k, v in statuses.items()}}
+
+
+def _run_web(args):
+    corpus_dir, paths, rounds = args
+    work_dir = tempfile.mkdtemp(prefix="bench_web-")
+    try:
+        sys.path.insert(0, os.path.join(HERE, "..", "src"))
+        use_scratch_cache(work_dir)
+        import web_manager
+        web_manager.IMAGE_DIR = corpus_dir
+        client = web_manager.app.test_client()
+        urls = [f"/thumb/{os.path.relpath(p, corpus_dir)}" for p in paths]
+
+        rss_before = peak_rss_kb()
+        cold = _throughput(client, urls)
+        warm = _throughput(client, urls * rounds)
+        etags = {url: client.get(url).headers.get("ETag") for url in urls}
+        start = time.perf_counter()
+        revalidated = 0
+        for _ in range(rounds):
+            for url in urls:
+                revalidated += client.get(url, headers={"If-None-Match": etags[url]}).status_code == 304
+        elapsed = time.perf_counter() - start
+        rss_after = peak_rss_kb()
+        return {
+            "cold": cold,
+            "warm": warm,
+            "revalidate": {"requests": rounds * len(urls), "not_modified": revalidated,
+                           "requests_per_second": round(rounds * len(urls) / elapsed, 1)},
+            "peak_rss_kb": rss_after,
+            "peak_rss_delta_kb": rss_after - rss_before,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_screen(result):
+    print(f"Screen {result['screen'][0]}x{result['screen'][1]}  "
+          f"(peak RSS {result['peak_rss_kb'] / 1024:.0f} MB)")
+    for name, p in result["stages_ms"].items():
+        print(f"  {name:18} p50 {p['p50']:8.1f} ms  p90 {p['p90']:8.1f} ms  max {p['max']:8.1f} ms")
+    for label in ("cold", "warm"):
+        nav = result["navigation"][label]
+        thumb_hits = nav["thumbnail_hit_rate"]
+        print(f"  navigation {label:5}   p50 {nav['display_ms']['p50']:8.1f} ms  "
+              f"p90 {nav['display_ms']['p90']:8.1f} ms  surface hits {nav['surface_hit_rate']:.0%}  "
+              f"thumbnail hits {'-' if thumb_hits is None else format(thumb_hits, '.0%')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(HERE, ".corpus"))
+    parser.add_argument("--per-case", type=int, default=2, help="images per (format, resolution)")
+    parser.add_argument("--screens", default="800x480,1920x1080")
+    parser.add_argument("--repeat", type=int, default=2, help="timed runs of each stage per image")
+    parser.add_argument("--steps", type=int, default=TRACE_STEPS, help="length of the navigation trace")
+    parser.add_argument("--dwell", type=float, default=TRACE_DWELL, help="seconds between navigation steps")
+    parser.add_argument("--web-rounds", type=int, default=20, help="passes over the corpus for /thumb")
+    parser.add_argument("--out", default="bench_pipeline.json")
+    args = parser.parse_args()
+    screens = [tuple(int(v) for v in s.split("x")) for s in args.screens.split(",")]
+
+    paths = build_corpus(args.corpus, per_case=args.per_case)
+    ctx = multiprocessing.get_context("spawn")
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": _git_revision(),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "cpus": os.cpu_count()},
+        "corpus": {"images": len(paths), "per_case": args.per_case},
+        "screens": [],
+    }
+    for screen in screens:
+        # maxtasksperchild=1: a fresh process per run keeps the RSS numbers separate
+        with ctx.Pool(1, maxtasksperchild=1) as pool:
+            result = pool.apply(_run_screen, ((screen, paths, args.repeat, args.dwell, args.steps),))
+        results["screens"].append(result)
+        _print_screen(result)
+
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        web = pool.apply(_run_web, ((args.corpus, paths, args.web_rounds),))
+    results["web_thumb"] = web
+    print(f"/thumb: cold {web['cold']['requests_per_second']} req/s, "
+          f"warm {web['warm']['requests_per_second']} req/s, "
+          f"304 {web['revalidate']['requests_per_second']} req/s")
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""JPEG vs raw thumbnail cache: load latency and SD-card footprint.
+
+Renders the corpus into the frame's thumbnail cache in both formats
+(THUMBNAIL_FORMAT = "jpeg" and "raw"), then times _load_surface_from_thumbnail,
+the call that runs whenever an image isn't in the in-memory surface cache:
+
+- warm: the thumbnail is in the OS page cache
+- cold: the file's pages are dropped first (posix_fadvise DONTNEED), so the
+  read comes from the storage device, as after a reboot or under memory pressure
+
+Footprint is the space the files take on disk (allocated blocks), per image
+and in total. For raw thumbnails it also reports how many cached images fit
+under THUMB_CACHE_MAX_BYTES. Run it on the device itself: both the SD card and
+the CPU decide which format wins.
+
+    python benchmarks/bench_thumbcache.py --screens 800x480,1920x1080 --out bench_thumbcache.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from corpus import build_corpus  # noqa: E402
+from common import percentiles, load_frame, use_scratch_cache  # noqa: E402
+
+
+def _drop_from_page_cache(path):
+    # Flush, then ask the kernel to forget the file's pages; a no-op where unsupported
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _disk_bytes(path):
+    st = os.stat(path)
+    return st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+
+
+def _run_format(frame, screen, paths, fmt, cache_dir, repeat):
+    import pygame
+    size = screen.get_size()
+    frame.THUMBNAIL_FORMAT = fmt
+    frame.thumbnail_format = frame._thumbnail_format_for(screen)
+    frame.CACHE_DIR = cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+
+    create, thumbs = [], []
+    for path in paths:
+        thumb = frame._thumbnail_path_for(path, size)
+        start = time.perf_counter()
+        frame._create_thumbnail(path, thumb, size, frame.thumbnail_format)
+        create.append((time.perf_counter() - start) * 1000)
+        thumbs.append(thumb)
+
+    warm, cold = [], []
+    for _ in range(repeat):
+        for thumb in thumbs:
+            frame._load_surface_from_thumbnail(thumb)  # make sure it's in the page cache
+            start = time.perf_counter()
+            frame._load_surface_from_thumbnail(thumb)
+            warm.append((time.perf_counter() - start) * 1000)
+
+            _drop_from_page_cache(thumb)
+            start = time.perf_counter()
+            frame._load_surface_from_thumbnail(thumb)
+            cold.append((time.perf_counter() - start) * 1000)
+            pygame.event.pump()
+
+    disk = [_disk_bytes(t) for t in thumbs]
+    total = sum(disk)
+    return {
+        "format": frame.thumbnail_format,
+        "create_ms": percentiles(create),
+        "load_warm_ms": percentiles(warm),
+        "load_cold_ms": percentiles(cold),
+        "disk_bytes_total": total,
+        "disk_bytes_per_image": round(total / len(disk)),
+        "images_per_cache_cap": int(frame.THUMB_CACHE_MAX_BYTES // (total / len(disk))),
+    }
+
+
+def _run_screen(args):
+    screen_size, paths, repeat = args
+    work_dir = tempfile.mkdtemp(prefix="bench_thumbcache-")
+    try:
+        use_scratch_cache(work_dir)
+        frame = load_frame()
+        import pygame
+        pygame.init()
+        screen = pygame.display.set_mode(screen_size)
+        results = {fmt: _run_format(frame, screen, paths, fmt, os.path.join(work_dir, fmt), repeat)
+                   for fmt in ("jpeg", "raw")}
+        pygame.quit()
+        return {"screen": list(screen_size), "formats": results}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _print_screen(result):
+    print(f"Screen {result['screen'][0]}x{result['screen'][1]}")
+    for r in result["formats"].values():
+        print(f"  {r['format']:9} load warm p50 {r['load_warm_ms']['p50']:6.1f} ms  "
+              f"cold p50 {r['load_cold_ms']['p50']:6.1f} ms  p90 {r['load_cold_ms']['p90']:6.1f} ms  "
+              f"create p50 {r['create_ms']['p50']:7.1f} ms  "
+              f"{r['disk_bytes_per_image'] / 1024:7.0f} KB/image  "
+              f"({r['images_per_cache_cap']} images per cache cap)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(HERE, ".corpus"))
+    parser.add_argument("--per-case", type=int, default=2, help="images per (format, resolution)")
+    parser.add_argument("--screens", default="800x480,1920x1080")
+    parser.add_argument("--repeat", type=int, default=3, help="timed loads of each thumbnail")
+    parser.add_argument("--out", default="bench_thumbcache.json")
+    args = parser.parse_args()
+    screens = [tuple(int(v) for v in s.split("x")) for s in args.screens.split(",")]
+
+    paths = build_corpus(args.corpus, per_case=args.per_case)
+    ctx = multiprocessing.get_context("spawn")
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "cpus": os.cpu_count()},
+        "corpus": {"images": len(paths), "per_case": args.per_case},
+        "screens": [],
+    }
+    for screen in screens:
+        # A fresh process per screen size: the display mode is set once per process
+        with ctx.Pool(1, maxtasksperchild=1) as pool:
+            result = pool.apply(_run_screen, ((screen, paths, args.repeat),))
+        results["screens"].append(result)
+        _print_screen(result)
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
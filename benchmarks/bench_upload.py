@@ -0,0 +1,330 @@
+"""Bulk upload: the multipart /upload form vs the chunked /api/uploads API.
+
+Generates a batch of incompressible files (default 2 GB in 8 MB files) and
+uploads it to a web manager started with src/serve.py, which gets a fresh
+Pics/ directory, its own cache directory (PHOTO_FRAME_CACHE_DIR: media index,
+ingest staging, upload sessions) and a benchmark login:
+
+- form:    POST /upload multipart, as the browser form does. One request is
+           capped by MAX_CONTENT_LENGTH, so the batch is split into requests
+           just under it. The whole batch in one request is tried first and
+           reported (it is refused)
+- chunked: /api/uploads sessions, PARALLEL files at a time, CHUNK_SIZE chunks,
+           committed with their SHA-256
+
+Per target it reports throughput (MB/s over the upload requests) and the
+server's peak RSS (VmHWM). It also reports the largest total of files the
+server held open in its temporary directory: Werkzeug spools multipart
+parts there, and /tmp is often RAM on a Pi. Ingest of the uploaded files runs in the
+background during the upload, the same way for both targets.
+
+    python benchmarks/bench_upload.py --total-mb 2048 --file-mb 8 --out bench_upload.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(HERE, "..", "src"))
+sys.path.insert(0, HERE)
+sys.path.insert(0, SRC_DIR)
+
+from loadtest_web import _free_port  # noqa: E402
+from common import use_scratch_cache  # noqa: E402
+
+PARALLEL = 3
+USER = ("bench", "bench-password")
+# serve.py with a known login, so the benchmark doesn't touch config/users.json
+SERVER = ("import sys; sys.path.insert(0, {src!r}); import web_manager, serve; "
+          "from werkzeug.security import generate_password_hash; "
+          "web_manager.USERS = {{{user!r}: generate_password_hash({password!r})}}; "
+          "serve.serve_gunicorn(web_manager.app, serve.parse_args(['--bind', '127.0.0.1:{port}', '--threads', '8']))")
+
+
+def make_batch(directory, total_mb, file_mb):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(max(1, total_mb // file_mb)):
+        path = os.path.join(directory, f"upload_{i:05d}.jpg")
+        if not os.path.exists(path) or os.path.getsize(path) != file_mb * 1024 * 1024:
+            with open(path, "wb") as f:
+                for _ in range(file_mb):
+                    f.write(os.urandom(1024 * 1024))
+        paths.append(path)
+    return paths
+
+
+def start_server(work_dir, tmp_dir):
+    port = _free_port()
+    env = dict(os.environ, TMPDIR=tmp_dir, PHOTO_FRAME_CACHE_DIR=os.path.join(work_dir, ".cache"))
+    cmd = [sys.executable, "-c", SERVER.format(src=SRC_DIR, user=USER[0], password=USER[1], port=port)]
+    proc = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            login(port)
+            return proc, port
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            time.sleep(0.3)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def login(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    body = f"username={USER[0]}&password={USER[1]}"
+    conn.request("POST", "/login", body, {"Content-Type": "application/x-www-form-urlencoded"})
+    response = conn.getresponse()
+    response.read()
+    cookie = response.getheader("Set-Cookie")
+    if not cookie:
+        raise OSError("login failed")
+    return cookie.split(";")[0]
+
+
+def _children(pid):
+    # gunicorn serves from a worker process under the arbiter
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(c) for c in f.read().split()]
+    except OSError:
+        return []
+
+
+def peak_rss(pid):
+    """Largest VmHWM among the server process and its children, in bytes"""
+    peak = 0
+    for p in [pid] + _children(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        peak = max(peak, int(line.split()[1]) * 1024)
+        except OSError:
+            pass
+    return peak
+
+
+class SpoolWatcher:
+    """Samples the server's open files under `directory` in the background and keeps the largest total.
+
+    Spooled uploads are unlinked as soon as they're created, so they're found
+    through /proc/<pid>/fd rather than by listing the directory.
+    """
+
+    def __init__(self, pid, directory, interval=0.05):
+        self.pid = pid
+        self.directory = directory
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        total = 0
+        for p in [self.pid] + _children(self.pid):
+            try:
+                fds = os.listdir(f"/proc/{p}/fd")
+            except OSError:
+                continue
+            for fd in fds:
+                link = f"/proc/{p}/fd/{fd}"
+                try:
+                    if os.readlink(link).startswith(self.directory):
+                        total += os.stat(link).st_size
+                except OSError:
+                    pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._sample())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _multipart_request(port, cookie, paths):
+    # Stream a multipart body from disk, the way a browser sends the upload form
+    boundary = uuid.uuid4().hex
+    heads = [(f"--{boundary}\r\nContent-Disposition: form-data; name=\"files\"; "
+              f"filename=\"{os.path.basename(p)}\"\r\nContent-Type: image/jpeg\r\n\r\n").encode() for p in paths]
+    tail = f"--{boundary}--\r\n".encode()
+    length = sum(len(h) + os.path.getsize(p) + 2 for h, p in zip(heads, paths)) + len(tail)
+
+    def body():
+        for head, path in zip(heads, paths):
+            yield head
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    yield chunk
+            yield b"\r\n"
+        yield tail
+
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+    try:
+        conn.request("POST", "/upload", body(), {"Cookie": cookie, "Content-Length": str(length),
+                                                 "Content-Type": f"multipart/form-data; boundary={boundary}"})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except OSError:
+        return None  # the server may close the connection on an oversized request
+    finally:
+        conn.close()
+
+
+def run_form(port, cookie, paths, max_request_bytes):
+    whole = _multipart_request(port, cookie, paths)
+    batches, batch, size = [], [], 0
+    for path in paths:
+        file_size = os.path.getsize(path) + 1024
+        if batch and size + file_size > max_request_bytes:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(path)
+        size += file_size
+    if batch:
+        batches.append(batch)
+
+    start = time.perf_counter()
+    statuses = [_multipart_request(port, cookie, b) for b in batches]
+    return {"whole_batch_status": whole, "requests": len(batches),
+            "failed_requests": sum(1 for s in statuses if s not in (200, 302)),
+            "seconds": time.perf_counter() - start}
+
+
+def _chunked_upload(port, cookie, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    headers = {"Cookie": cookie, "Content-Type": "application/json"}
+    size = os.path.getsize(path)
+    conn.request("POST", "/api/uploads", json.dumps({"path": os.path.basename(path), "size": size}), headers)
+    response = conn.getresponse()
+    session = json.loads(response.read())
+    if response.status != 201:
+        raise RuntimeError(session)
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        offset = 0
+        while offset < size:
+            chunk = f.read(session["chunk_size"])
+            h.update(chunk)
+            conn.request("PUT", f"/api/uploads/{session['id']}?offset={offset}", chunk,
+                         {"Cookie": cookie, "Content-Type": "application/octet-stream"})
+            response = conn.getresponse()
+            result = json.loads(response.read())
+            if response.status != 200:
+                raise RuntimeError(result)
+            offset = result["offset"]
+    conn.request("POST", f"/api/uploads/{session['id']}/commit", json.dumps({"sha256": h.hexdigest()}), headers)
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    if response.status != 200:
+        raise RuntimeError(f"commit failed with {response.status}")
+
+
+def run_chunked(port, cookie, paths):
+    pending = list(paths)
+    lock = threading.Lock()
+    failures = []
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                path = pending.pop(0)
+            try:
+                _chunked_upload(port, cookie, path)
+            except (OSError, RuntimeError) as e:
+                failures.append(str(e))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(PARALLEL)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {"failed_files": len(failures), "seconds": time.perf_counter() - start}
+
+
+def run_target(name, paths):
+    import web_manager
+    work_dir = tempfile.mkdtemp(prefix="bench_upload-")
+    tmp_dir = os.path.join(work_dir, "tmp")
+    os.makedirs(os.path.join(work_dir, "Pics"))
+    os.makedirs(tmp_dir)
+    proc, port = start_server(work_dir, tmp_dir)
+    try:
+        cookie = login(port)
+        total = sum(os.path.getsize(p) for p in paths)
+        with SpoolWatcher(proc.pid, tmp_dir) as spool:
+            if name == "form":
+                result = run_form(port, cookie, paths, web_manager.app.config["MAX_CONTENT_LENGTH"])
+            else:
+                result = run_chunked(port, cookie, paths)
+        result.update(target=name, bytes=total,
+                      mb_per_second=round(total / 1048576 / result["seconds"], 1),
+                      peak_rss_bytes=peak_rss(proc.pid), peak_temp_bytes=spool.peak)
+        return result
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--total-mb", type=int, default=2048)
+    parser.add_argument("--file-mb", type=int, default=8)
+    parser.add_argument("--targets", default="form,chunked")
+    parser.add_argument("--batch-dir", default=os.path.join(HERE, ".upload_batch"))
+    parser.add_argument("--out", default="bench_upload.json")
+    args = parser.parse_args()
+
+    paths = make_batch(args.batch_dir, args.total_mb, args.file_mb)
+    # run_target imports web_manager here too (for its request size limit)
+    scratch = tempfile.mkdtemp(prefix="bench_upload-cache-")
+    use_scratch_cache(scratch)
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "cpus": os.cpu_count()},
+        "batch": {"files": len(paths), "file_mb": args.file_mb},
+        "targets": [],
+    }
+    for name in args.targets.split(","):
+        result = run_target(name, paths)
+        results["targets"].append(result)
+        extra = (f", whole batch in one request: HTTP {result['whole_batch_status']}, "
+                 f"{result['requests']} requests needed" if name == "form" else "")
+        print(f"{name:8} {result['mb_per_second']:7.1f} MB/s  peak RSS {result['peak_rss_bytes'] / 1048576:6.0f} MB  "
+              f"peak temp {result['peak_temp_bytes'] / 1048576:6.0f} MB{extra}")
+
+    shutil.rmtree(scratch, ignore_errors=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
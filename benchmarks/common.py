@@ -0,0 +1,56 @@
+"""Helpers shared by the benchmark scripts."""
+import os
+import sys
+import math
+import resource
+import importlib.util
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(HERE, "..", "src")
+
+
+def peak_rss_kb():
+    """Peak RSS of this process in kB.
+
+    VmHWM is per address space, so unlike ru_maxrss it isn't inherited from
+    the (much bigger) parent across fork/exec.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """{"p50": .., "p90": .., "p99": .., "max": .., "n": ..} of a list of milliseconds (nearest rank)"""
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+    result = {"n": len(ordered)}
+    for p in points:
+        rank = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+        result[f"p{p}"] = round(ordered[rank], 2)
+    result["max"] = round(ordered[-1], 2)
+    return result
+
+
+def use_scratch_cache(directory):
+    """Send the caches, indexes and runtime state of src/ modules imported (and servers
+    started) after this to `directory`, so a benchmark never touches the project's .cache"""
+    os.environ["PHOTO_FRAME_CACHE_DIR"] = directory
+
+
+def load_frame():
+    """Import src/Rpi-Photo-Frame.py (not importable by name) under SDL's dummy drivers"""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    spec = importlib.util.spec_from_file_location("frame", os.path.join(SRC_DIR, "Rpi-Photo-Frame.py"))
+    frame = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(frame)
+    return frame
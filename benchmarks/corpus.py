@@ -0,0 +1,51 @@
+"""Generate a synthetic photo corpus for the benchmarks.
+
+Images are smooth gradients with some noise so encoders behave roughly like
+they do on real photos (pure flat colours compress unrealistically well).
+"""
+import os
+import random
+from PIL import Image, ImageFilter
+import pillow_heif
+pillow_heif.register_heif_opener()
+
+FORMATS = {"jpeg": ".jpg", "png": ".png", "bmp": ".bmp", "heic": ".heic"}
+RESOLUTIONS = [(1600, 1200), (4032, 3024)]
+
+
+def _photo_like(size, seed):
+    rng = random.Random(seed)
+    w, h = size
+    # Gradient base, scaled up from a tiny random image so it's cheap to make
+    base = Image.new("RGB", (4, 3))
+    base.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(12)])
+    im = base.resize(size, Image.Resampling.BICUBIC)
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    return Image.blend(im, noise, 0.15).filter(ImageFilter.SMOOTH)
+
+
+def build_corpus(directory, formats=None, resolutions=None, per_case=2, orientation=None):
+    """Write `per_case` images per (format, resolution) into `directory`; returns their paths.
+
+    Existing files are reused, so repeated runs don't pay the encoding cost again.
+    `orientation` adds that EXIF orientation tag to the JPEGs.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for fmt in formats or FORMATS:
+        for w, h in resolutions or RESOLUTIONS:
+            for i in range(per_case):
+                path = os.path.join(directory, f"{fmt}-{w}x{h}-{i}{FORMATS[fmt]}")
+                if not os.path.exists(path):
+                    im = _photo_like((w, h), seed=hash((fmt, w, h, i)) & 0xFFFF)
+                    if fmt == "jpeg":
+                        exif = Image.Exif()
+                        if orientation:
+                            exif[0x0112] = orientation
+                        im.save(path, "JPEG", quality=90, exif=exif.tobytes())
+                    elif fmt == "heic":
+                        im.save(path, "HEIF", quality=80)
+                    else:
+                        im.save(path, fmt.upper())
+                paths.append(path)
+    return paths
@@ -0,0 +1,189 @@
+"""Load test for the web manager: development server vs src/serve.py.
+
+Each target is started as a subprocess serving the benchmark corpus (as its
+Pics/ directory) on a local port. Client threads with keep-alive connections
+then run these scenarios:
+
+- thumbs:      cached gallery thumbnails
+- renditions:  cached view-size renditions from /image
+- originals:   full-size originals from /image?original=1
+- thumbs+slow: cached thumbnails while one extra client keeps forcing a fresh
+               thumbnail render (the "one slow thumbnail stalls everything" case)
+
+For each scenario it reports requests per second and p50/p95/p99 latency.
+Each target gets its own scratch cache directory (PHOTO_FRAME_CACHE_DIR), so
+the project's .cache and media index are never touched.
+
+    python benchmarks/loadtest_web.py --targets dev,serve --clients 8 --seconds 10 --out loadtest_web.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(HERE, "..", "src"))
+sys.path.insert(0, HERE)
+
+from corpus import build_corpus  # noqa: E402
+from common import percentiles  # noqa: E402
+
+# The setup before src/serve.py: Flask's single-threaded development server
+DEV_SERVER = ("import sys; sys.path.insert(0, {src!r}); import web_manager; "
+              "web_manager.app.run(host='127.0.0.1', port={port}, debug=False, threaded=False)")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_target(name, work_dir, threads, workers):
+    port = _free_port()
+    env = dict(os.environ, PHOTO_FRAME_CACHE_DIR=os.path.join(work_dir, f".cache-{name}"))
+    if name == "dev":
+        cmd = [sys.executable, "-c", DEV_SERVER.format(src=SRC_DIR, port=port)]
+    else:
+        cmd = [sys.executable, os.path.join(SRC_DIR, "serve.py"), "--bind", f"127.0.0.1:{port}",
+               "--threads", str(threads), "--workers", str(workers)]
+    proc = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return proc, port
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{name} server exited with code {proc.returncode}")
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{name} server did not start listening on port {port}")
+
+
+def _client(port, urls, stop, latencies, errors, before_request=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    i = 0
+    while not stop.is_set():
+        url = urls[i % len(urls)]
+        i += 1
+        if before_request is not None:
+            before_request(url)
+        start = time.perf_counter()
+        try:
+            conn.request("GET", url)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            if response.getheader("Connection", "").lower() == "close" or response.version == 10:
+                conn.close()
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    conn.close()
+
+
+def run_scenario(port, urls, clients, seconds, slow_urls=None, corpus_dir=None):
+    stop = threading.Event()
+    results = [([], []) for _ in range(clients)]
+    threads = [threading.Thread(target=_client, args=(port, urls[i:] + urls[:i], stop, *results[i]))
+               for i in range(clients)]
+    if slow_urls:
+        def invalidate(url):
+            # A new mtime changes the thumbnail key, so the server has to render it again
+            rel_path = urllib.parse.unquote(url.split("/thumb/", 1)[1])
+            os.utime(os.path.join(corpus_dir, rel_path))
+        threads.append(threading.Thread(target=_client, args=(port, slow_urls, stop, [], [], invalidate)))
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies = [ms for lat, _ in results for ms in lat]
+    errors = [e for _, errs in results for e in errs]
+    return {"clients": clients, "requests": len(latencies), "errors": len(errors),
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "latency_ms": percentiles(latencies, (50, 95, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(HERE, ".corpus"))
+    parser.add_argument("--targets", default="dev,serve", help="comma separated: dev, serve")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--threads", type=int, default=8, help="threads per worker for serve.py")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for serve.py")
+    parser.add_argument("--out", default="loadtest_web.json")
+    args = parser.parse_args()
+
+    paths = build_corpus(args.corpus, per_case=1)
+    # The slow client re-renders its own copies, so the other clients' thumbnails stay cached
+    rel_paths = [os.path.basename(p) for p in paths]
+    quote = urllib.parse.quote
+    thumb_urls = [f"/thumb/{quote(p)}" for p in rel_paths]
+    rendition_urls = [f"/image/{quote(p)}?fmt=jpeg" for p in rel_paths]
+    original_urls = [f"/image/{quote(p)}?original=1" for p in rel_paths]
+
+    work_dir = tempfile.mkdtemp(prefix="loadtest_web-")
+    pics = os.path.join(work_dir, "Pics")
+    os.makedirs(os.path.join(pics, "slow"))
+    for path in paths:
+        os.symlink(os.path.abspath(path), os.path.join(pics, os.path.basename(path)))
+    slow_path = next((p for p in paths if p.endswith(".jpg")), paths[0])
+    slow_copy = os.path.join("slow", os.path.basename(slow_path))
+    shutil.copyfile(slow_path, os.path.join(pics, slow_copy))
+    slow_urls = [f"/thumb/{quote(slow_copy)}"]
+
+    results = {"started": time.strftime("%Y-%m-%dT%H:%M:%S"), "clients": args.clients,
+               "seconds": args.seconds, "targets": {}}
+    try:
+        for target in args.targets.split(","):
+            proc, port = start_target(target, work_dir, args.threads, args.workers)
+            try:
+                # Warm the caches so the scenarios measure delivery, not rendering
+                for url in thumb_urls + rendition_urls:
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+                    conn.request("GET", url)
+                    conn.getresponse().read()
+                    conn.close()
+                scenarios = {
+                    "thumbs": run_scenario(port, thumb_urls, args.clients, args.seconds),
+                    "renditions": run_scenario(port, rendition_urls, args.clients, args.seconds),
+                    "originals": run_scenario(port, original_urls, args.clients, args.seconds),
+                    "thumbs+slow": run_scenario(port, thumb_urls, args.clients, args.seconds,
+                                                slow_urls=slow_urls, corpus_dir=pics),
+                }
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+            results["targets"][target] = scenarios
+            for name, r in scenarios.items():
+                lat = r["latency_ms"]
+                print(f"{target:6} {name:12} {r['requests_per_second']:8.1f} req/s  "
+                      f"p50 {lat.get('p50', 0):7.1f} ms  p95 {lat.get('p95', 0):7.1f} ms  errors {r['errors']}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,184 @@
 import os
-import random
-import hashlib
-import gc
+import mmap
+import sqlite3
 import threading
-from collections import OrderedDict
-import pygame
 import time
+from collections import OrderedDict, deque
+import pygame
 import platform
-from PIL import Image
 import pillow_heif
+from media_index import MediaIndex
+from library_watcher import LibraryWatcher
+from playback import PlaybackScheduler
+from disk_cache import DiskCache
+import thumbnails
+import decode
+from thumbnails import create_thumbnail as _create_thumbnail
+from frame_metrics import metrics
+import frame_control
+import rendition_store
+from work_scheduler import work
+from paths import CACHE_ROOT
 pillow_heif.register_heif_opener()
 
-# Thumbnail cache directory (inside project .cache by default)
-ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-CACHE_DIR = os.path.join(ROOT_DIR, ".cache", "thumbs")
+# Thumbnail cache directory
+CACHE_DIR = os.path.join(CACHE_ROOT, "thumbs")
 os.makedirs(CACHE_DIR, exist_ok=True)
+PRERENDER_PROGRESS_FILE = os.path.join(CACHE_ROOT, "prerender.json")
+THUMB_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # cap for CACHE_DIR on the SD card
+THUMB_CACHE_GC_SECONDS = 6 * 3600           # how often to prune stale/orphaned thumbnails
+
+# On-disk thumbnail cache index (size cap, LRU eviction, garbage collection)
+thumb_cache = DiskCache(CACHE_DIR, THUMB_CACHE_MAX_BYTES)
+thumbnail_format = "jpeg"   # resolved in main() from THUMBNAIL_FORMAT and the display's pixel format
 
 # Runtime caching / prefetch settings
 PREFETCH_COUNT = 3        # how many upcoming images to cache in memory
-SURFACE_CACHE_SIZE = 6    # max number of surfaces to keep in memory
+PREFETCH_BACK_COUNT = 2   # how many images back in history to keep warm for the back gesture
+PREFETCH_QUEUE_SIZE = 8   # max pending prefetch jobs; older requests are dropped
+SURFACE_CACHE_BYTES = None          # memory budget for decoded surfaces; None = fraction of RAM below
+SURFACE_CACHE_RAM_FRACTION = 0.08   # share of available RAM (at startup) used when no fixed budget
+SURFACE_CACHE_MIN_FREE = 96 * 1024 * 1024  # shrink the cache when available RAM drops below this
+PRERENDER = True          # fill the thumbnail cache for the whole library in the background
+PRERENDER_CACHE_SHARE = 0.9  # share of THUMB_CACHE_MAX_BYTES pre-render may fill; the rest is for on-demand thumbnails
+
+# Custom pygame events; the main loop sleeps until one of these (or input) arrives
+ADVANCE_EVENT = pygame.USEREVENT + 1        # auto-advance timer fired
+PREFETCH_DONE_EVENT = pygame.USEREVENT + 2  # prefetcher finished warming `path`
+LIBRARY_EVENT = pygame.USEREVENT + 3        # watcher saw `added` / `removed` images
+IMAGE_READY_EVENT = pygame.USEREVENT + 4    # display loader decoded `path` into `surface` (None on failure)
+CONTROL_EVENT = pygame.USEREVENT + 5        # web manager command `cmd` (see frame_control); set `done` when handled
+LIBRARY_LOADED_EVENT = pygame.USEREVENT + 6 # startup library scan finished with `images`
+
+
+def _available_memory():
+    # Bytes of RAM available to new allocations (Linux), or None if unknown
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class SurfaceCache:
+    # LRU cache of decoded surfaces (path -> pygame.Surface) bounded by their real
+    # pixel memory rather than a fixed count. It also gives memory back when the
+    # system runs low, since the frame shares a small Pi with the web manager.
+
+    def __init__(self, budget_bytes=None, min_free_bytes=SURFACE_CACHE_MIN_FREE):
+        if budget_bytes is None:
+            available = _available_memory()
+            # ~48 MB (a few 1600x1200 surfaces) when RAM can't be measured
+            budget_bytes = int(available * SURFACE_CACHE_RAM_FRACTION) if available else 48 * 1024 * 1024
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self._entries = OrderedDict()  # path -> (surface, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pressure_evictions = 0
+
+    @staticmethod
+    def surface_bytes(surface):
+        return surface.get_pitch() * surface.get_height()
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._entries
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path):
+        # Return the cached surface (marking it recently used) or None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(path)
+            return entry[0]
+
+    def touch(self, path):
+        # Mark as recently used without counting a hit; returns whether it was cached
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+                return True
+            return False
+
+    def put(self, path, surface):
+        nbytes = self.surface_bytes(surface)
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[path] = (surface, nbytes)
+            self._bytes += nbytes
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self._bytes > self.budget_bytes and len(self._entries) > 1:
+                self._evict_oldest()
+        self.check_memory_pressure()
+
+    def pop(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def shrink(self, keep=1):
+        # Drop least recently used surfaces until at most `keep` remain
+        with self._lock:
+            dropped = 0
+            while len(self._entries) > keep:
+                self._evict_oldest()
+                dropped += 1
+            return dropped
+
+    def check_memory_pressure(self):
+        # Shrink if the system is running out of RAM
+        available = _available_memory()
+        if available is None or available >= self.min_free_bytes:
+            return
+        dropped = self.shrink(keep=1)
+        if dropped:
+            self.pressure_evictions += dropped
+            print(f"Low memory ({available // (1024 * 1024)} MB available): dropped {dropped} cached surfaces")
 
-# In-memory surface cache (path -> pygame.Surface), LRU
-surface_cache = OrderedDict()
-cache_lock = threading.Lock()
+    def _evict_oldest(self):
+        _, (_, nbytes) = self._entries.popitem(last=False)
+        self._bytes -= nbytes
+        self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pressure_evictions": self.pressure_evictions,
+            }
+
+
+# In-memory surface cache (path -> pygame.Surface), LRU, byte-budgeted
+surface_cache = SurfaceCache(SURFACE_CACHE_BYTES)
+
+# Per-thumbnail [lock, waiters] so the UI and the prefetcher never render the same file twice
+_thumbnail_locks = {}
+_thumbnail_locks_guard = threading.Lock()
 
 
 if platform.system() == "Windows": # for development only
@@ -35,9 +191,22 @@ else:
 
 # ---------------------- CONFIGURATION ----------------------
 DISPLAY_SECONDS = 45               # how long to show each image
+TRANSITION = "crossfade"           # "none", "crossfade" or "slide"
+TRANSITION_SECONDS = 0.6           # duration of a transition
+TRANSITION_FPS = 30                # target frame rate; frames are dropped to hold the duration
 SUPPORTED_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp", ".heic"]
+HISTORY_SIZE = 500                 # images remembered for the back gesture
+FAST_START = True                  # show the last image right away; scan the library in the background
+THUMBNAIL_FORMAT = "jpeg"          # "jpeg", or "raw": display-ready pixels, no decode on load, width*height*4 bytes each
+RENDITION_SOURCE = None            # web manager URL ("http://photoframe.local:5000") or its .cache/frame_renditions
+                                   # directory: copy ready-made screen-sized images instead of decoding originals
+FRAME_NAME = platform.node()       # how this frame registers with RENDITION_SOURCE
+RENDITION_TOKEN = None             # with a URL: the contents of the web manager's config/frame_token
 # -----------------------------------------------------------
 
+# Playback order (fair shuffle) and back/forward history; survives restarts via .cache/playback.json
+playback = PlaybackScheduler(IMAGE_DIR, history_size=HISTORY_SIZE)
+
 
 def load_image_paths(directory):
     # Return a sorted list of image file paths found recursively under `directory`.
@@ -50,24 +219,21 @@ def load_image_paths(directory):
             print(f"Warning: could not create image directory: {directory}")
             return []
 
+    # The shared media index only re-lists directories whose mtime changed since
+    # the last refresh, so startup stays flat as the library grows.
+    # Paths come back sorted and unique (folders then files alphabetically).
+    try:
+        index = MediaIndex(directory, SUPPORTED_EXTENSIONS)
+        index.refresh()
+        return [os.path.join(directory, p) for p in index.paths()]
+    except (sqlite3.Error, OSError) as e:
+        # e.g. locked past its timeout by the web manager's own first scan;
+        # the library watcher brings the index up to date later
+        print(f"Media index unavailable ({e}); listing {directory} directly")
     paths = []
     for root, dirs, files in os.walk(directory):
-        for fname in files:
-            if any(fname.lower().endswith(ext) for ext in SUPPORTED_EXTENSIONS):
-                paths.append(os.path.join(root, fname))
-
-    # Sort for deterministic order (folders then files alphabetically)
-    paths.sort()
-
-    # Remove duplicates while preserving order (defensive)
-    seen = set()
-    unique_paths = []
-    for p in paths:
-        if p not in seen:
-            seen.add(p)
-            unique_paths.append(p)
-
-    return unique_paths
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(tuple(SUPPORTED_EXTENSIONS)))
+    return sorted(paths)
 
 
 def scale_to_screen(img, screen_size):
@@ -79,74 +245,379 @@ def scale_to_screen(img, screen_size):
 
 
 def _thumbnail_path_for(image_path, screen_size):
-    # Use path + mtime + screen size to generate a cache filename
+    return thumbnails.thumbnail_path_for(CACHE_DIR, image_path, screen_size, thumbnail_format)
+
+
+def _thumbnail_format_for(screen):
+    # THUMBNAIL_FORMAT resolved for this display: raw thumbnails are stored in the
+    # display's own byte order, so loading them is a plain copy
+    if THUMBNAIL_FORMAT != "raw":
+        return "jpeg"
+    if screen.get_bytesize() == 4:
+        masks = screen.get_masks()[:3]
+        if masks == (0xff0000, 0xff00, 0xff):
+            return "raw-BGRX"
+        if masks == (0xff, 0xff00, 0xff0000):
+            return "raw-RGBX"
+    return "raw-RGB"
+
+
+def _remove_thumbnails_for(image_paths):
+    # Delete every cached thumbnail of `image_paths` (any mtime / screen size).
+    # Runs on a worker thread: a folder delete can mean thousands of files.
+    thumb_cache.remove_sources(image_paths)
+    # ...including ones written by another process that aren't indexed yet;
+    # one listing of CACHE_DIR for the whole batch
+    prefixes = {thumbnails.thumbnail_prefix_for(p) for p in image_paths}
     try:
-        mtime = int(os.path.getmtime(image_path))
+        names = os.listdir(CACHE_DIR)
     except OSError:
-        mtime = 0
-    key = f"{image_path}-{mtime}-{screen_size[0]}x{screen_size[1]}"
-    h = hashlib.sha1(key.encode("utf-8")).hexdigest()
-    # keep original extension as .jpg for cached thumbnails
-    return os.path.join(CACHE_DIR, f"{h}.jpg")
+        return
+    for name in names:
+        if name.split("-", 1)[0] in prefixes:
+            try:
+                os.remove(os.path.join(CACHE_DIR, name))
+            except OSError:
+                pass
+
+
+def _ensure_thumbnail(image_path, screen_size):
+    # Return the cached thumbnail path for image_path, creating it if needed.
+    # Concurrent callers for the same thumbnail wait for the first one instead of
+    # decoding the original again.
+    thumb_path = _thumbnail_path_for(image_path, screen_size)
+    with _thumbnail_locks_guard:
+        entry = _thumbnail_locks.setdefault(thumb_path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            if os.path.exists(thumb_path):
+                thumb_cache.touch(thumb_path)
+                metrics.count("thumbnail_hits")
+            else:
+                if not (RENDITION_SOURCE and _fetch_rendition(image_path, thumb_path, screen_size)):
+                    with metrics.timer("thumbnail_create_ms"):
+                        _create_thumbnail(image_path, thumb_path, screen_size, thumbnail_format)
+                thumb_cache.record(thumb_path, image_path)
+                metrics.count("thumbnail_misses")
+    finally:
+        with _thumbnail_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                _thumbnail_locks.pop(thumb_path, None)
+    return thumb_path
+
+
+def _fetch_rendition(image_path, thumb_path, screen_size):
+    # Copy the web manager's rendition of image_path into the thumbnail cache.
+    # False if it isn't available, and the caller decodes the original instead.
+    try:
+        with metrics.timer("rendition_fetch_ms"):
+            found = rendition_store.fetch(RENDITION_SOURCE, os.path.relpath(image_path, IMAGE_DIR),
+                                          os.path.getmtime(image_path), screen_size, thumbnail_format, thumb_path,
+                                          token=RENDITION_TOKEN)
+    except OSError as e:
+        print(f"Could not fetch rendition of {image_path} from {RENDITION_SOURCE}: {e}")
+        found = False
+    metrics.count("rendition_fetches" if found else "rendition_misses")
+    return found
 
 
-def _create_thumbnail(src_path, dst_path, screen_size):
-    # Create a small cached version of the image that fits screen_size.
-    # Use Image.draft where possible to reduce memory when decoding large files.
-    with Image.open(src_path) as im:
+def _fetch_renditions(paths, screen_size, max_bytes):
+    # Rendition mode's pre-render pass: copy everything the web manager has ready,
+    # in order, until the thumbnails (cached or fetched) fill max_bytes. As in
+    # thumbnails.prerender, last-used times follow the order so the upcoming ones are evicted last.
+    # Anything it doesn't have yet is fetched (or decoded) when it comes up.
+    fetched = used = kept = 0
+    start = time.time()
+    for rank, path in enumerate(paths):
+        thumb_path = _thumbnail_path_for(path, screen_size)
+        last_used = start - rank * thumbnails.PRERENDER_RANK_SECONDS
         try:
-            im.draft("RGB", screen_size)
-        except Exception:
+            used += os.path.getsize(thumb_path)
+            if used > max_bytes:
+                break
+            kept += 1
+            thumb_cache.touch(thumb_path, last_used)
+            continue
+        except OSError:
             pass
-        im = im.convert("RGB")
-        im.thumbnail(screen_size, Image.Resampling.LANCZOS)
-        # save with reasonable quality to reduce size
-        im.save(dst_path, format="JPEG", quality=85, optimize=True)
-    # encourage GC after heavy operations
-    gc.collect()
+        if kept and used + used / kept > max_bytes:
+            break   # an average one wouldn't fit either
+        try:
+            if not rendition_store.fetch(RENDITION_SOURCE, os.path.relpath(path, IMAGE_DIR),
+                                         os.path.getmtime(path), screen_size, thumbnail_format, thumb_path,
+                                         ready_only=True, token=RENDITION_TOKEN):
+                continue
+            used += os.path.getsize(thumb_path)
+        except OSError as e:
+            print(f"Stopped fetching renditions from {RENDITION_SOURCE}: {e}")
+            break
+        if used > max_bytes:
+            # Keeping it would make the cache evict the ones fetched first, which come up sooner
+            try:
+                os.remove(thumb_path)
+            except OSError:
+                pass
+            break
+        thumb_cache.record(thumb_path, path, last_used)
+        fetched += 1
+        kept += 1
+    print(f"Fetched {fetched} renditions from {RENDITION_SOURCE}")
+
+
+def _thumbnail_cache_gc(screen_size, images):
+    # Prune thumbnails whose source is gone or that were rendered for an older
+    # mtime / another screen size, then enforce the size cap. Runs forever.
+    # `images` is the live playlist, used to identify unindexed thumbnails by prefix.
+    def is_current(source, filename):
+        return os.path.basename(_thumbnail_path_for(source, screen_size)) == filename
+
+    while True:
+        by_prefix = {thumbnails.thumbnail_prefix_for(p): p for p in list(images)}
+        try:
+            removed = thumb_cache.gc(is_current, lambda name: by_prefix.get(name.split("-", 1)[0]))
+            stats = thumb_cache.stats()
+            print(f"Thumbnail cache: removed {removed}, {stats['entries']} files, "
+                  f"{stats['bytes'] // (1024 * 1024)} MB of {stats['max_bytes'] // (1024 * 1024)} MB")
+        except Exception as e:
+            print(f"Thumbnail cache cleanup failed: {e}")
+        time.sleep(THUMB_CACHE_GC_SECONDS)
 
 
 def _load_surface_from_thumbnail(thumb_path):
     # Load a pygame surface from disk and return it. Caller should handle exceptions.
-    return pygame.image.load(thumb_path).convert()
+    with metrics.timer("surface_load_ms"):
+        if thumb_path.endswith(".raw"):
+            return _load_raw_surface(thumb_path)
+        return pygame.image.load(thumb_path).convert()
 
 
-def _ensure_prefetch(images, start_index, screen_size):
-    # Prefetch thumbnails + surfaces for the next PREFETCH_COUNT images starting at start_index.
-    def _worker():
-        n = len(images)
-        if n == 0:
-            return
-        for i in range(start_index, start_index + PREFETCH_COUNT):
-            idx = i % n
-            path = images[idx]
-            thumb = _thumbnail_path_for(path, screen_size)
+def _load_raw_surface(thumb_path):
+    # Map a raw thumbnail and convert its pixels straight into the display format
+    with open(thumb_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        layout, size = thumbnails.read_raw_header(mm)
+        pixels = memoryview(mm)[thumbnails.RAW_HEADER.size:]
+        try:
+            mapped = pygame.image.frombuffer(pixels, size, thumbnails.RAW_LAYOUTS[layout][1])
+            surface = mapped.convert()
+            # The mapping can only close once nothing refers to it
+            del mapped
+        finally:
+            pixels.release()
+    return surface
+
+
+class Prefetcher:
+    # A single long-lived worker that warms thumbnails + surfaces ahead of navigation.
+    # schedule() replaces the pending queue, so work requested for a navigation
+    # position the user has already left is dropped instead of piling up.
+
+    def __init__(self, screen_size, max_pending=PREFETCH_QUEUE_SIZE, on_ready=None):
+        self.screen_size = screen_size
+        self.on_ready = on_ready  # called with each path once its surface is cached
+        self._pending = deque(maxlen=max_pending)
+        self._in_flight = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def depth(self):
+        # Jobs queued or in progress
+        with self._cond:
+            return len(self._pending) + (self._in_flight is not None)
+
+    def schedule(self, paths):
+        # Queue `paths` (most important first), cancelling anything queued before
+        with self._cond:
+            self._pending.clear()
+            for path in paths:
+                if path != self._in_flight and path not in self._pending:
+                    self._pending.append(path)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                path = self._pending.popleft()
+                self._in_flight = path
             try:
-                if not os.path.exists(thumb):
-                    _create_thumbnail(path, thumb, screen_size)
-
-                with cache_lock:
-                    if path in surface_cache:
-                        # move to end = mark as recently used
-                        surface_cache.move_to_end(path)
-                        continue
-
-                surf = _load_surface_from_thumbnail(thumb)
-
-                with cache_lock:
-                    surface_cache[path] = surf
-                    # trim cache
-                    while len(surface_cache) > SURFACE_CACHE_SIZE:
-                        surface_cache.popitem(last=False)
+                self._warm(path)
+                if self.on_ready is not None:
+                    self.on_ready(path)
             except Exception:
                 # ignore individual failures — they'll be skipped at display time
-                continue
+                pass
+            finally:
+                with self._cond:
+                    self._in_flight = None
+
+    def _warm(self, path):
+        if surface_cache.touch(path):
+            return
+        # An upcoming slide: background rendering (here and in the web manager) waits for it
+        with work.urgent():
+            thumb = _ensure_thumbnail(path, self.screen_size)
+            surface_cache.put(path, _load_surface_from_thumbnail(thumb))
+
+
+class Transition:
+    # Animated change between two images (crossfade or slide) without a GPU path.
+    # Works from the already-scaled surfaces in surface_cache and composes into two
+    # screen-sized buffers allocated once, so a transition allocates nothing per frame.
+    # Progress follows the clock, so on a slow device frames are dropped rather than
+    # stretching the transition.
+
+    def __init__(self, screen, style=TRANSITION, seconds=TRANSITION_SECONDS, fps=TRANSITION_FPS):
+        self.screen = screen
+        self.style = style
+        self.seconds = seconds
+        self.frame_interval = 1.0 / fps
+        self._from = screen.copy()
+        self._to = screen.copy()
+
+    def _compose(self, target, image):
+        target.fill((0, 0, 0))
+        target.blit(image, image.get_rect(center=target.get_rect().center))
+
+    def run(self, old_image, new_image, direction=1):
+        # Animate from old_image to new_image; the caller draws the final frame.
+        # A tap, control command or quit during the transition cuts it short so input stays responsive.
+        self._compose(self._from, old_image)
+        self._compose(self._to, new_image)
+        width = self.screen.get_width()
+
+        frame_times = []
+        dropped = 0
+        start = time.perf_counter()
+        next_frame = start
+        while True:
+            frame_start = time.perf_counter()
+            progress = (frame_start - start) / self.seconds
+            if progress >= 1 or pygame.event.peek([pygame.MOUSEBUTTONDOWN, CONTROL_EVENT, pygame.QUIT]):
+                break
+
+            if self.style == "slide":
+                offset = int(width * progress) * direction
+                self.screen.blit(self._from, (-offset, 0))
+                self.screen.blit(self._to, (width * direction - offset, 0))
+            else:
+                self.screen.blit(self._from, (0, 0))
+                self._to.set_alpha(int(255 * progress))
+                self.screen.blit(self._to, (0, 0))
+            pygame.display.flip()
+
+            now = time.perf_counter()
+            frame_times.append(now - frame_start)
+            # Wait for the next frame slot; skip any slots we've already missed
+            next_frame += self.frame_interval
+            if now > next_frame:
+                missed = int((now - next_frame) / self.frame_interval) + 1
+                dropped += missed
+                next_frame += missed * self.frame_interval
+            else:
+                time.sleep(next_frame - now)
+
+        self._to.set_alpha(None)
+        self._log(frame_times, dropped, time.perf_counter() - start)
+
+    def _log(self, frame_times, dropped, elapsed):
+        if not frame_times:
+            return
+        ms = sorted(t * 1000 for t in frame_times)
+        p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+        metrics.gauge("transition_fps", round(len(ms) / elapsed, 1))
+        metrics.gauge("transition_dropped_frames", dropped)
+        print(f"Transition {self.style}: {len(ms)} frames in {elapsed:.2f}s "
+              f"({len(ms) / elapsed:.1f} fps), frame avg {sum(ms) / len(ms):.1f} ms, "
+              f"p95 {p95:.1f} ms, max {ms[-1]:.1f} ms, dropped {dropped}")
+
+
+def _load_display_surface(path, screen_size):
+    # Decode `path` into a screen-sized surface, caching it. Returns None if it can't be loaded.
+    # Runs on worker threads, never on the UI thread.
+    try:
+        with metrics.timer("display_load_ms"), work.urgent():
+            thumb_path = _ensure_thumbnail(path, screen_size)
+            image = _load_surface_from_thumbnail(thumb_path)
+        # store into cache
+        surface_cache.put(path, image)
+        return image
+    except MemoryError:
+        # Last resort: the pressure check in SurfaceCache should normally get here first
+        surface_cache.shrink(keep=0)
+        print(f"MemoryError loading {path} — skipping image")
+        return None
+    except Exception as e:
+        try:
+            pil_img = decode.open_for_screen(path, screen_size)
+            data = pil_img.tobytes()
+            return pygame.image.fromstring(data, pil_img.size, pil_img.mode)
+        except Exception as e2:
+            print(f"Failed to load image {path}: {e} / {e2}")
+            metrics.count("load_failures")
+            return None
+
+
+def render_image(screen, image, paused=False, status_font=None):
+    # Draw `image` centered on a black screen (plus the pause indicator) and flip
+    screen_width, screen_height = screen.get_size()
+    rect = image.get_rect(center=(screen_width // 2, screen_height // 2))
+
+    screen.fill((0, 0, 0))
+    screen.blit(image, rect)
+
+    # Draw paused indicator if paused
+    if paused and status_font is not None:
+        try:
+            s = status_font.render("PAUSED", True, (255, 255, 255))
+            bg = pygame.Surface((s.get_width() + 20, s.get_height() + 10), pygame.SRCALPHA)
+            bg.fill((0, 0, 0, 160))
+            bx = 10
+            by = 10
+            screen.blit(bg, (bx, by))
+            screen.blit(s, (bx + 10, by + 5))
+        except Exception:
+            pass
 
-    t = threading.Thread(target=_worker, daemon=True)
-    t.start()
+    pygame.display.flip()
+
+
+class DisplayLoader:
+    # Decodes the image the user asked to see on a worker thread, so touch input is
+    # never blocked by a slow decode. There is a single request slot: asking for a new
+    # image while another is still waiting replaces it, so rapid taps only decode the
+    # latest target (plus whatever was already in progress).
+
+    def __init__(self, screen_size, on_loaded):
+        self.screen_size = screen_size
+        self.on_loaded = on_loaded  # called with (path, surface or None)
+        self._requested = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, path):
+        with self._cond:
+            self._requested = path
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._requested is None:
+                    self._cond.wait()
+                path, self._requested = self._requested, None
+            surface = surface_cache.get(path)
+            if surface is None:
+                surface = _load_display_surface(path, self.screen_size)
+            self.on_loaded(path, surface)
 
 
 def main():
+    boot_started = time.monotonic()   # for the time-to-first-image log
     pygame.init()
     pygame.mouse.set_visible(False)
     pygame.font.init()
@@ -158,6 +629,21 @@ def main():
         screen = pygame.display.set_mode((800, 480))
 
     screen_width, screen_height = screen.get_size()
+    metrics.gauge("screen", [screen_width, screen_height])
+    global thumbnail_format
+    thumbnail_format = _thumbnail_format_for(screen)
+    metrics.gauge("thumbnail_format", thumbnail_format)
+
+    if RENDITION_SOURCE:
+        # Tell the web manager which size and format to build for this frame
+        def register_frame():
+            try:
+                rendition_store.register(RENDITION_SOURCE, FRAME_NAME, (screen_width, screen_height), thumbnail_format,
+                                         token=RENDITION_TOKEN)
+                print(f"Registered {FRAME_NAME} ({screen_width}x{screen_height}, {thumbnail_format}) with {RENDITION_SOURCE}")
+            except (OSError, rendition_store.RegistryError) as e:
+                print(f"Could not register with {RENDITION_SOURCE}: {e}")
+        threading.Thread(target=register_frame, daemon=True).start()
 
     # small font for status text (pause indicator)
     try:
@@ -165,151 +651,409 @@ def main():
     except Exception:
         status_font = None
 
-    # Load images (recursive)
-    images = load_image_paths(IMAGE_DIR)
-    if not images:
-        print("No images found!")
-        return
+    # Bring back the previous run's history and cycle; the library itself is
+    # scanned in the background and merged in when it's ready
+    if playback.restore():
+        print(f"Resuming playback (cycle {playback.cycle}, {len(playback.history)} images of history)")
+
+    # Only wake the main loop for events it handles (motion events would wake it constantly)
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, ADVANCE_EVENT, PREFETCH_DONE_EVENT,
+                              LIBRARY_EVENT, IMAGE_READY_EVENT, CONTROL_EVENT, LIBRARY_LOADED_EVENT])
 
-    # Shuffle order to intersperse images from different folders
-    random.shuffle(images)
+    def post(event_type, **attrs):
+        # Events from worker threads carry their post time, so the loop can measure its lag
+        pygame.event.post(pygame.event.Event(event_type, posted=time.monotonic(), **attrs))
+
+    def scan_library():
+        # Load images (recursive); runs on a worker thread
+        started = time.monotonic()
+        try:
+            images = load_image_paths(IMAGE_DIR)
+        except Exception as e:
+            # Still report back, or the frame would wait on the restored image forever
+            print(f"Library scan failed: {e}")
+            images = []
+        post(LIBRARY_LOADED_EVENT, images=images, seconds=time.monotonic() - started)
+
+    watcher = None            # started once the library is loaded
 
-    # Navigation tracking
-    history = []              # images already shown
-    future = []               # images we can go forward to after going back
-    current_index = 0
     paused = False
+    advance_due = None        # when the advance timer should next fire (for lag metrics)
 
-    last_switch_time = time.time()
+    def restart_advance_timer():
+        # (Re)start the auto-advance countdown; a zero interval disarms it while paused
+        nonlocal advance_due
+        pygame.time.set_timer(ADVANCE_EVENT, 0 if paused else int(DISPLAY_SECONDS * 1000))
+        advance_due = None if paused else time.monotonic() + DISPLAY_SECONDS
 
-    def display_image(path):
-        thumb_path = _thumbnail_path_for(path, (screen_width, screen_height))
+    prefetcher = Prefetcher(
+        (screen_width, screen_height),
+        on_ready=lambda path: post(PREFETCH_DONE_EVENT, path=path))
+    prerender_thread = None
 
-        # Prefer in-memory cached surface
-        with cache_lock:
-            surface = surface_cache.get(path)
+    def start_prerender():
+        # Warm the on-disk cache for the library, upcoming playlist entries first, as
+        # far as PRERENDER_CACHE_SHARE of the cache goes (a library that doesn't fit
+        # would otherwise evict its first thumbnails to make room for the last ones).
+        # A pass is cheap when most thumbnails already exist, so just run another
+        # after library changes.
+        nonlocal prerender_thread
+        if not PRERENDER or (prerender_thread is not None and prerender_thread.is_alive()):
+            return
+        budget = int(THUMB_CACHE_MAX_BYTES * PRERENDER_CACHE_SHARE)
+        if RENDITION_SOURCE:
+            # The web manager renders for us; just copy its renditions over
+            prerender_thread = threading.Thread(
+                target=_fetch_renditions, args=(playback.prerender_order(), (screen_width, screen_height), budget),
+                daemon=True)
+        else:
+            prerender_thread = threading.Thread(
+                target=thumbnails.prerender,
+                args=(playback.prerender_order(), CACHE_DIR, (screen_width, screen_height), PRERENDER_PROGRESS_FILE),
+                kwargs={"cache": thumb_cache, "fmt": thumbnail_format, "max_bytes": budget},
+                daemon=True)
+        prerender_thread.start()
+
+    def schedule_prefetch(backwards=False):
+        # Warm the images the user is likely to see next, forward and back through
+        # the history. Whichever direction the user is moving goes first.
+        ahead = playback.peek(PREFETCH_COUNT)
+        behind = playback.behind(PREFETCH_BACK_COUNT)
+        prefetcher.schedule(behind + ahead if backwards else ahead + behind)
+
+    loader = DisplayLoader(
+        (screen_width, screen_height),
+        lambda path, surface: post(IMAGE_READY_EVENT, path=path, surface=surface))
+    pending_path = None       # image we're waiting on the loader for
+    pending_direction = 0
+    pending_since = 0.0
+    shown_image = None        # surface currently on screen
+    transition = Transition(screen, TRANSITION, TRANSITION_SECONDS, TRANSITION_FPS) if TRANSITION in ("crossfade", "slide") else None
 
+    def display_image(path, direction=1):
+        # Show `path` now if its surface is cached; otherwise keep the current image
+        # (with a loading indicator) and let the loader swap the new one in when ready.
+        # direction: 1 = forward, -1 = back, 0 = redraw in place (no transition)
+        nonlocal pending_path, pending_direction, pending_since
+        surface = surface_cache.get(path)
         if surface is not None:
-            image = surface
-        else:
-            try:
-                if not os.path.exists(thumb_path):
-                    _create_thumbnail(path, thumb_path, (screen_width, screen_height))
-
-                image = _load_surface_from_thumbnail(thumb_path)
-                # store into cache
-                with cache_lock:
-                    surface_cache[path] = image
-                    surface_cache.move_to_end(path)
-                    while len(surface_cache) > SURFACE_CACHE_SIZE:
-                        surface_cache.popitem(last=False)
-            except MemoryError:
-                print(f"MemoryError loading {path} — skipping image")
-                return
-            except Exception as e:
-                try:
-                    with Image.open(path) as pil_img:
-                        pil_img.draft("RGB", (screen_width, screen_height))
-                        pil_img = pil_img.convert("RGB")
-                        pil_img.thumbnail((screen_width, screen_height), Image.Resampling.LANCZOS)
-                        data = pil_img.tobytes()
-                        image = pygame.image.fromstring(data, pil_img.size, pil_img.mode)
-                except Exception as e2:
-                    print(f"Failed to load image {path}: {e} / {e2}")
-                    return
+            if pending_path == path:
+                metrics.timing("display_wait_ms", (time.monotonic() - pending_since) * 1000)
+            pending_path = None
+            draw_image(surface, direction)
+            return
+        pending_path = path
+        pending_direction = direction
+        pending_since = time.monotonic()
+        loader.request(path)
+        draw_loading_indicator()
+
+    def draw_image(image, direction=0):
+        nonlocal shown_image, boot_started
+        if transition is not None and direction and shown_image is not None and image is not shown_image:
+            # The transition blocks the loop; don't keep a web manager command waiting on it
+            answer_controls()
+            transition.run(shown_image, image, direction)
+        shown_image = image
+        render_image(screen, image, paused, status_font)
+        if boot_started is not None:
+            elapsed = time.monotonic() - boot_started
+            boot_started = None
+            metrics.gauge("time_to_first_image_s", round(elapsed, 2))
+            print(f"Time to first image: {elapsed:.2f}s "
+                  f"({'library loaded' if watcher is not None else 'library still loading'})")
 
-        # Center on screen
-        rect = image.get_rect(center=(screen_width // 2, screen_height // 2))
+    def draw_loading_indicator():
+        # Small dot in the bottom-right corner; cleared when the next image is drawn
+        if shown_image is None:
+            return
+        center = (screen_width - 24, screen_height - 24)
+        pygame.draw.circle(screen, (0, 0, 0), center, 12)
+        pygame.draw.circle(screen, (255, 255, 255), center, 8)
+        pygame.display.update(pygame.Rect(screen_width - 36, screen_height - 36, 24, 24))
 
-        screen.fill((0, 0, 0))
-        screen.blit(image, rect)
+    def apply_library_changes(added, removed):
+        removed_set = set(removed)
+        if removed_set:
+            for path in removed_set:
+                surface_cache.pop(path)
+            # Only the in-memory surfaces go here; the thumbnails on disk are cleaned up off the UI thread
+            threading.Thread(target=_remove_thumbnails_for, args=(list(removed_set),), daemon=True).start()
 
-        # Draw paused indicator if paused
-        if paused and status_font is not None:
-            try:
-                s = status_font.render("PAUSED", True, (255, 255, 255))
-                bg = pygame.Surface((s.get_width() + 20, s.get_height() + 10), pygame.SRCALPHA)
-                bg.fill((0, 0, 0, 160))
-                bx = 10
-                by = 10
-                screen.blit(bg, (bx, by))
-                screen.blit(s, (bx + 10, by + 5))
-            except Exception:
-                pass
+            showing = playback.current()
+            playback.remove(removed_set)
+            if showing in removed_set and len(playback):
+                # The image on screen is gone; show the next one instead
+                display_image(playback.advance())
+
+        # New images join the current cycle, so they come up soon
+        added = playback.add(added)
+
+        if len(playback) and playback.current() is None:
+            # Library was empty; start showing the new images
+            display_image(playback.advance())
+
+        if added:
+            start_prerender()
+
+        if added or removed_set:
+            print(f"Library updated: +{len(added)} -{len(removed_set)} ({len(playback)} images)")
+
+    def library_loaded(images, seconds):
+        # The startup scan finished: hand the library to the scheduler and start
+        # everything that works on the whole library. False if there's nothing to show.
+        nonlocal watcher
+        playback.load(images)
+        print(f"Library loaded: {len(playback)} images in {seconds:.1f}s")
+        metrics.timing("library_load_ms", seconds * 1000)
+        if not len(playback) and playback.current() is None:
+            print("No images found!")
+            return False
+
+        # Watch the library so uploads/deletes show up without a restart.
+        # The watcher thread only posts changes; the main loop applies them.
+        watcher = LibraryWatcher(
+            IMAGE_DIR, SUPPORTED_EXTENSIONS,
+            lambda added, removed: post(LIBRARY_EVENT, added=added, removed=removed))
+        watcher.start()
 
-        pygame.display.flip()
+        if shown_image is None and pending_path is None:
+            display_image(playback.current() or playback.advance())
+        schedule_prefetch()
+        start_prerender()
+        threading.Thread(target=_thumbnail_cache_gc, args=((screen_width, screen_height), playback.paths), daemon=True).start()
+        return True
 
+    def cached_image():
+        # With no saved history: an image that already has a thumbnail for this
+        # screen (most recently used first), so it can go up without decoding the original
+        for path in thumb_cache.recent_sources(20):
+            if os.path.isfile(path) and os.path.exists(_thumbnail_path_for(path, (screen_width, screen_height))):
+                return path
+        return None
 
-    # Display first image
-    history.append(images[current_index])
-    display_image(history[-1])
-    # Prefetch next images
-    _ensure_prefetch(images, current_index + 1, (screen_width, screen_height))
+    def go_back():
+        path = playback.back()
+        if path is not None:
+            display_image(path, direction=-1)
+
+            # reset auto-advance timer instead of pausing
+            restart_advance_timer()
+            schedule_prefetch(backwards=True)
+
+    def go_forward():
+        # Back through images we went back from, else on to a new one
+        path = playback.forward()
+        if path is None:
+            # Still waiting for the library scan
+            return
+        display_image(path)
+
+        # reset auto-advance timer instead of pausing
+        restart_advance_timer()
+
+        # Prefetch upcoming images
+        schedule_prefetch()
+
+    def set_paused(value):
+        nonlocal paused
+        paused = value
+        restart_advance_timer()
+        # Immediately redraw the current image so the PAUSED indicator shows/hides
+        try:
+            if playback.current():
+                display_image(playback.current(), direction=0)
+        except Exception:
+            pass
+
+    def show_path(rel_path):
+        # Jump to one image (relative to IMAGE_DIR) out of turn; the playlist carries on afterwards
+        rel_path = os.path.normpath(rel_path or "")
+        path = os.path.join(IMAGE_DIR, rel_path)
+        if rel_path.startswith("..") or os.path.isabs(rel_path) or not os.path.isfile(path) \
+                or not path.lower().endswith(tuple(SUPPORTED_EXTENSIONS)):
+            raise ValueError(f"not an image in the library: {rel_path}")
+        # Not picked up by the watcher yet?
+        playback.add([path])
+        if playback.current() == path:
+            return
+        playback.show(path)
+        display_image(path)
+        restart_advance_timer()
+        schedule_prefetch()
+
+    def frame_status():
+        rel = lambda path: os.path.relpath(path, IMAGE_DIR) if path else None
+        return {
+            "showing": rel(playback.current()),
+            "loading": rel(pending_path),
+            "paused": paused,
+            "advance_in": round(max(0.0, advance_due - time.monotonic()), 1) if advance_due else None,
+            "images": len(playback),
+            "library": "ready" if watcher is not None else "loading",
+            "history": len(playback.history),
+            "cycle": playback.cycle,
+            "upcoming": [rel(p) for p in playback.peek(PREFETCH_COUNT)],
+            "prefetch_queue": prefetcher.depth(),
+        }
+
+    control_waiting = []      # CONTROL_EVENTs being handled, answered by answer_controls()
+
+    def handle_control(cmd, args):
+        # Runs on the event loop; see frame_control for the protocol
+        if cmd in ("next", "prev") and playback.current() is None:
+            raise ValueError("nothing is showing yet")
+        if cmd == "show":
+            show_path(args.get("path"))
+        elif cmd == "next":
+            go_forward()
+        elif cmd == "prev":
+            go_back()
+        elif cmd in ("pause", "resume"):
+            if paused != (cmd == "pause"):
+                set_paused(cmd == "pause")
+        elif cmd == "reload":
+            if watcher is None:
+                raise ValueError("the library is still loading")
+            apply_library_changes(*watcher.refresh_now())
+
+    def answer_controls():
+        # Reply with the state after the command: navigation is settled by now,
+        # even if the new image is still transitioning in or loading
+        while control_waiting:
+            event = control_waiting.pop()
+            if "ok" not in event.reply:
+                event.reply.update(ok=True, status=frame_status())
+            metrics.timing("control_ms", (time.monotonic() - event.posted) * 1000)
+            event.done.set()
+
+    def control_dispatch(cmd, args):
+        # Called on a control connection's thread: hand the command to the event loop and wait
+        reply = {}
+        done = threading.Event()
+        post(CONTROL_EVENT, cmd=cmd, args=args, reply=reply, done=done)
+        if not done.wait(frame_control.TIMEOUT):
+            return {"ok": False, "error": "the frame is busy; try again"}
+        return reply
+
+    # Fast start: put up the image that was on screen when the last run stopped (or
+    # one with a cached thumbnail) now, rather than after the library scan
+    if FAST_START:
+        if playback.current() is None:
+            first = cached_image()
+            if first is not None:
+                playback.show(first)
+        if playback.current() is not None:
+            display_image(playback.current())
+            schedule_prefetch()
+    threading.Thread(target=scan_library, daemon=True).start()
+
+    # Publish health numbers for the web manager's /metrics page
+    metrics.add_collector(lambda: {
+        "images": len(playback),
+        "paused": paused,
+        "showing": playback.current(),
+        "prefetch_queue": prefetcher.depth(),
+        "surface_cache": surface_cache.stats(),
+        "thumbnail_cache": thumb_cache.stats(),
+        "work": work.status(),
+    })
+    metrics.start_publisher()
+
+    # Commands from the web manager (show / next / prev / pause / resume / reload / status)
+    try:
+        frame_control.ControlServer(control_dispatch).start()
+    except OSError as e:
+        print(f"Control channel unavailable: {e}")
+
+    restart_advance_timer()
 
     while True:
-        for event in pygame.event.get():
+        # Block until something happens: input, the advance timer, or a worker event.
+        # Then handle everything that queued up meanwhile.
+        for event in [pygame.event.wait()] + pygame.event.get():
             if event.type == pygame.QUIT:
                 return
-            
+
+            # Event-loop lag: how long worker events / the advance timer waited to be handled
+            if hasattr(event, "posted"):
+                metrics.timing("event_lag_ms", (time.monotonic() - event.posted) * 1000)
+            elif event.type == ADVANCE_EVENT and advance_due is not None:
+                metrics.timing("event_lag_ms", max(0.0, time.monotonic() - advance_due) * 1000)
+                advance_due += DISPLAY_SECONDS
+
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE or event.key == pygame.K_q:
                     return
 
+            if event.type == LIBRARY_EVENT:
+                apply_library_changes(event.added, event.removed)
+                continue
+
+            if event.type == PREFETCH_DONE_EVENT:
+                # The prefetcher may finish the image we're waiting on before the loader does
+                if event.path == pending_path:
+                    display_image(event.path, pending_direction)
+                continue
+
+            if event.type == IMAGE_READY_EVENT:
+                # Ignore results for images the user has already navigated away from
+                if event.path == pending_path:
+                    pending_path = None
+                    metrics.timing("display_wait_ms", (time.monotonic() - pending_since) * 1000)
+                    if event.surface is not None:
+                        draw_image(event.surface, pending_direction)
+                continue
+
+            if event.type == CONTROL_EVENT:
+                control_waiting.append(event)
+                try:
+                    handle_control(event.cmd, event.args)
+                except Exception as e:
+                    event.reply.update(ok=False, error=str(e))
+                answer_controls()
+                continue
+
+            if event.type == LIBRARY_LOADED_EVENT:
+                if not library_loaded(event.images, event.seconds):
+                    return
+                continue
+
+            if playback.current() is None:
+                # Nothing to show yet (library still loading, or everything was deleted)
+                continue
+
             if event.type == pygame.MOUSEBUTTONDOWN:
                 x, y = event.pos
 
                 # LEFT TOUCH → BACK
                 if x < screen_width * 0.33:
-                    if len(history) > 1:
-                        # Move current into future history
-                        future.append(history.pop())
-                        display_image(history[-1])
-
-                        # reset auto-advance timer instead of pausing
-                        last_switch_time = time.time()
-                        _ensure_prefetch(images, current_index + 1, (screen_width, screen_height))
+                    go_back()
 
                 # MIDDLE TOUCH → PAUSE / UNPAUSE
                 elif x < screen_width * 0.66:
-                    paused = not paused
-                    # Immediately redraw the current image so the PAUSED indicator shows/hides
-                    try:
-                        if history:
-                            display_image(history[-1])
-                    except Exception:
-                        pass
+                    set_paused(not paused)
 
                 # RIGHT TOUCH → FORWARD
                 else:
-                    if future:
-                        # Continue along previous path
-                        next_img = future.pop()
-                        history.append(next_img)
-                        display_image(next_img)
-                    else:
-                        # Regular forward navigation
-                        current_index = (current_index + 1) % len(images)
-                        next_img = images[current_index]
-                        history.append(next_img)
-                        display_image(next_img)
-
-                    # reset auto-advance timer instead of pausing
-                    last_switch_time = time.time()
-
-                    # Prefetch upcoming images
-                    _ensure_prefetch(images, current_index + 1, (screen_width, screen_height))
-
-        # Automatic switching (if not paused)
-        if not paused and (time.time() - last_switch_time > DISPLAY_SECONDS):
-            current_index = (current_index + 1) % len(images)
-            next_img = images[current_index]
-            history.append(next_img)
-            future.clear()     # once you move forward naturally, future is invalidated
-            display_image(next_img)
-            last_switch_time = time.time()
-
-        time.sleep(0.01)
+                    go_forward()
+
+            # Automatic switching (the timer is disarmed while paused)
+            if event.type == ADVANCE_EVENT and not paused:
+                # Moving on naturally forgets the images we went back from
+                path = playback.advance()
+                if path is not None:
+                    display_image(path)
+                    schedule_prefetch()
+
+            playback.save()
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        thumb_cache.save(force=True)
+        playback.save(force=True)
+        metrics.publish()
@@ -0,0 +1,195 @@
+"""Resumable, chunked uploads for the web manager.
+
+A multipart POST has to arrive in one piece and passes through Werkzeug's
+form parser, which spools big parts to temporary storage. Instead, each file
+gets an upload session:
+
+1. create: the client names the target path and the file size
+2. write: the client sends raw chunks, each at an explicit offset. A chunk
+   is streamed to the session's .part file through a small fixed buffer
+3. commit: once every byte is there (and the optional SHA-256 matches), the
+   file goes to the ingest queue
+
+The session's offset is the size of its .part file. After a dropped
+connection or a restart, the client asks for it and carries on from there;
+at worst a half-written chunk is sent again. Sessions untouched for
+SESSION_SECONDS are deleted.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from paths import CACHE_ROOT
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+UPLOAD_DIR = os.path.join(CACHE_ROOT, "uploads")
+CHUNK_SIZE = 4 * 1024 * 1024          # suggested to clients
+MAX_CHUNK_BYTES = 16 * 1024 * 1024
+MAX_FILE_BYTES = 1024 * 1024 * 1024
+BUFFER_BYTES = 256 * 1024             # memory per chunk being written
+SESSION_SECONDS = 24 * 3600
+
+
+class UploadError(Exception):
+    """A request the session can't accept; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def _check_sha256(sha256):
+    if sha256 is not None and not isinstance(sha256, str):
+        raise UploadError("sha256 must be a hex string", 400)
+
+
+class UploadSessions:
+    """Upload sessions stored as <id>.json (target path, size) plus <id>.part in `upload_dir`"""
+
+    def __init__(self, upload_dir=UPLOAD_DIR):
+        self.upload_dir = upload_dir
+        self._lock = threading.Lock()
+        self._writing = set()   # sessions with a chunk in progress in this process
+        os.makedirs(upload_dir, exist_ok=True)
+
+    def _paths(self, session_id):
+        # Session ids are generated here; anything else can't name a file
+        try:
+            session_id = uuid.UUID(session_id).hex
+        except (ValueError, AttributeError, TypeError):
+            raise UploadError("no such upload", 404)
+        base = os.path.join(self.upload_dir, session_id)
+        return f"{base}.json", f"{base}.part"
+
+    def _meta(self, session_id):
+        meta_path, part_path = self._paths(session_id)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            offset = os.path.getsize(part_path)
+        except (OSError, ValueError):
+            raise UploadError("no such upload", 404)
+        return meta, offset
+
+    def create(self, rel_path, size, sha256=None):
+        """Start an upload of `size` bytes to `rel_path`; returns its status"""
+        if isinstance(size, bool) or not isinstance(size, int):
+            raise UploadError("size must be a whole number of bytes", 400)
+        if size < 0:
+            raise UploadError("size must not be negative", 400)
+        if size > MAX_FILE_BYTES:
+            raise UploadError(f"file too large (max {MAX_FILE_BYTES // (1024 * 1024)} MB)", 413)
+        _check_sha256(sha256)
+        self.cleanup()
+        session_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(session_id)
+        meta = {"rel_path": rel_path, "size": size, "sha256": sha256, "created": time.time()}
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        open(part_path, "wb").close()
+        return self._status(session_id, meta, 0)
+
+    def status(self, session_id):
+        meta, offset = self._meta(session_id)
+        return self._status(session_id, meta, offset)
+
+    def _status(self, session_id, meta, offset):
+        return {"id": session_id, "path": meta["rel_path"], "size": meta["size"], "offset": offset,
+                "chunk_size": CHUNK_SIZE}
+
+    def write(self, session_id, offset, stream, length):
+        """Append `length` bytes read from `stream` at `offset`; returns the new offset.
+
+        `offset` must be the session's current offset; otherwise UploadError (409)
+        carries the right one so the client can resume from there.
+        """
+        meta, current = self._meta(session_id)
+        if offset != current:
+            raise UploadError(f"expected offset {current}", 409, current)
+        if length > MAX_CHUNK_BYTES:
+            raise UploadError(f"chunk too large (max {MAX_CHUNK_BYTES // (1024 * 1024)} MB)", 413)
+        if offset + length > meta["size"]:
+            raise UploadError("chunk runs past the end of the file", 400)
+
+        _, part_path = self._paths(session_id)
+        with self._lock:
+            if session_id in self._writing:
+                raise UploadError("another chunk of this upload is in progress", 409, current)
+            self._writing.add(session_id)
+        try:
+            with open(part_path, "r+b") as f:
+                if fcntl is not None:
+                    # Same check across worker processes
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        raise UploadError("another chunk of this upload is in progress", 409, current)
+                f.seek(offset)
+                remaining = length
+                while remaining:
+                    data = stream.read(min(BUFFER_BYTES, remaining))
+                    if not data:
+                        break  # client went away; it resumes from what arrived
+                    f.write(data)
+                    remaining -= len(data)
+                offset = f.tell()
+        finally:
+            with self._lock:
+                self._writing.discard(session_id)
+        if offset != current + length:
+            raise UploadError("chunk ended early", 400, offset)
+        return offset
+
+    def commit(self, session_id, sha256=None):
+        """Check a complete upload; returns (part_path, rel_path) for the caller to move into place"""
+        _check_sha256(sha256)
+        meta, offset = self._meta(session_id)
+        if offset != meta["size"]:
+            raise UploadError(f"upload incomplete ({offset} of {meta['size']} bytes)", 409, offset)
+        expected = (sha256 or meta.get("sha256") or "").lower()
+        _, part_path = self._paths(session_id)
+        if expected:
+            h = hashlib.sha256()
+            with open(part_path, "rb") as f:
+                for chunk in iter(lambda: f.read(BUFFER_BYTES), b""):
+                    h.update(chunk)
+            if h.hexdigest() != expected:
+                self.abort(session_id)
+                raise UploadError("checksum mismatch; upload discarded", 422)
+        return part_path, meta["rel_path"]
+
+    def finish(self, session_id):
+        """Forget a committed session (its .part file has been moved away)"""
+        self.abort(session_id)
+
+    def abort(self, session_id):
+        for path in self._paths(session_id):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def cleanup(self):
+        """Delete sessions nobody has written to for SESSION_SECONDS"""
+        cutoff = time.time() - SESSION_SECONDS
+        for name in os.listdir(self.upload_dir):
+            if not name.endswith(".json"):
+                continue
+            session_id = name[:-len(".json")]
+            try:
+                meta_path, part_path = self._paths(session_id)
+                last = max(os.path.getmtime(meta_path), os.path.getmtime(part_path))
+            except (UploadError, OSError):
+                last = 0
+            if last < cutoff:
+                try:
+                    self.abort(session_id)
+                except UploadError:
+                    pass
@@ -0,0 +1,126 @@
+"""Decode images straight to screen size, taking the cheapest route per format.
+
+- An embedded preview (EXIF thumbnail, or a HEIF thumbnail image through
+  pillow_heif's draft support) is used when it is at least as large as the
+  image will be on screen, so the full-resolution data is never decoded.
+- JPEGs are decoded with DCT scaling (Image.draft), which decodes at 1/2,
+  1/4 or 1/8 size directly.
+- Whatever is still much larger than needed is shrunk with a cheap integer
+  reduce() before the final LANCZOS resample.
+
+EXIF orientation is applied, so portrait phone photos come out upright.
+"""
+import io
+from PIL import Image, ExifTags
+import pillow_heif
+pillow_heif.register_heif_opener()
+
+ORIENTATION_TAG = 0x0112
+# EXIF orientation -> transpose operations that make the image upright
+ORIENTATION_TRANSPOSE = {
+    2: [Image.Transpose.FLIP_LEFT_RIGHT],
+    3: [Image.Transpose.ROTATE_180],
+    4: [Image.Transpose.FLIP_TOP_BOTTOM],
+    5: [Image.Transpose.TRANSPOSE],
+    6: [Image.Transpose.ROTATE_270],
+    7: [Image.Transpose.TRANSVERSE],
+    8: [Image.Transpose.ROTATE_90],
+}
+# LANCZOS quality needs some headroom; only reduce() down to this multiple of the target
+REDUCE_HEADROOM = 2
+
+
+def fitted_size(image_size, box):
+    """Size of an image of `image_size` scaled to fit inside `box` (never upscaled)"""
+    w, h = image_size
+    scale = min(box[0] / w, box[1] / h, 1.0)
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+
+def _orientation(im):
+    try:
+        return im.getexif().get(ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+
+
+def _exif_preview(im, needed):
+    # Decode the JPEG thumbnail in EXIF IFD1 if it covers `needed`, else None
+    ifd1_tag = getattr(ExifTags.IFD, "IFD1", None)
+    raw = im.info.get("exif")
+    if ifd1_tag is None or not raw:
+        return None
+    try:
+        ifd1 = im.getexif().get_ifd(ifd1_tag)
+        offset, length = ifd1.get(0x0201), ifd1.get(0x0202)
+        if not offset or not length:
+            return None
+        tiff = raw[6:] if raw.startswith(b"Exif\x00\x00") else raw
+        preview = Image.open(io.BytesIO(tiff[offset:offset + length]))
+        if preview.width < needed[0] or preview.height < needed[1]:
+            return None
+        # Reject previews with a different aspect ratio (letterboxed or cropped)
+        if abs(preview.width * im.height - preview.height * im.width) > 2 * max(im.size):
+            return None
+        preview.load()
+        return preview
+    except Exception:
+        return None
+
+
+def _resample(im, size):
+    # Integer reduce() while we're well above the target, then one LANCZOS pass
+    factor = min(im.width // size[0], im.height // size[1]) // REDUCE_HEADROOM
+    if factor > 1:
+        im = im.reduce(factor)
+    if im.width > size[0] or im.height > size[1]:
+        im = im.resize(size, Image.Resampling.LANCZOS)
+    return im
+
+
+def open_for_screen(path, box):
+    """Decode `path` to an upright RGB image that fits inside `box`.
+
+    The returned image has `decode_route` in its info dict ("preview", "draft" or "full").
+    """
+    with Image.open(path) as im:
+        orientation = _orientation(im)
+        # Orientations 5-8 swap width and height, so size the decode for the rotated box
+        rotated = orientation in (5, 6, 7, 8)
+        decode_box = (box[1], box[0]) if rotated else tuple(box)
+        final_size = fitted_size(im.size, decode_box)
+
+        route = "full"
+        source = _exif_preview(im, final_size) if im.format == "JPEG" else None
+        if source is not None:
+            route = "preview"
+        else:
+            source = im
+            try:
+                # JPEG: DCT scaling; HEIF: picks an embedded thumbnail that's big enough
+                if im.draft("RGB", final_size) is not None:
+                    route = "preview" if im.format == "HEIF" else "draft"
+            except Exception:
+                pass
+
+        out = source.convert("RGB")
+        out = _resample(out, fitted_size(out.size, decode_box))
+
+    # (pillow_heif applies HEIF rotation itself and reports orientation 1)
+    for op in ORIENTATION_TRANSPOSE.get(orientation, []):
+        out = out.transpose(op)
+    out.info["decode_route"] = route
+    return out
+
+
+def open_legacy(path, box):
+    """The previous decode path (draft + full convert + thumbnail), kept for benchmarks"""
+    with Image.open(path) as im:
+        try:
+            im.draft("RGB", tuple(box))
+        except Exception:
+            pass
+        im = im.convert("RGB")
+        im.thumbnail(tuple(box), Image.Resampling.LANCZOS)
+        return im
+
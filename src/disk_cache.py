@@ -0,0 +1,226 @@
+"""Size-capped directory of derived image files (thumbnails, renditions).
+
+The cache keeps a compact JSON index next to the files that maps each
+source image to its cache entries, so entries can be garbage-collected once
+their source is deleted or their key goes stale (edited photo, new screen
+size). Least recently used entries are evicted to stay under a byte cap.
+
+To spare the SD card, use timestamps live in memory and the index is only
+written when entries were added or removed, at most every `save_seconds`.
+Only one process may write a cache's index: others sharing the directory
+open it `read_only` and leave their files to the writer's next gc().
+"""
+import os
+import json
+import time
+import heapq
+import threading
+
+INDEX_NAME = "index.json"
+
+
+class DiskCache:
+    def __init__(self, cache_dir, max_bytes, save_seconds=900, read_only=False, ignore=()):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.save_seconds = save_seconds
+        self.read_only = read_only  # keep the index in memory only; another process writes it
+        self.ignore = set(ignore)   # other files kept in cache_dir, never adopted or evicted
+        self.index_path = os.path.join(cache_dir, INDEX_NAME)
+        self._entries = {}  # filename -> [source, size, last_used]
+        self._by_source = {}  # source -> set of filenames, so removing a source doesn't scan every entry
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.time()
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for source, entries in data.items():
+            for filename, size, last_used in entries:
+                # "" collects files whose source isn't known
+                self._add(filename, source or None, size, last_used)
+
+    def save(self, force=False):
+        """Write the index if it changed (and, unless forced, the save interval has passed)"""
+        with self._lock:
+            if self.read_only or not self._dirty or (not force and time.time() - self._last_save < self.save_seconds):
+                return
+            by_source = {}
+            for filename, (source, size, last_used) in self._entries.items():
+                by_source.setdefault(source or "", []).append([filename, size, int(last_used)])
+            self._dirty = False
+            self._last_save = time.time()
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(by_source, f, separators=(",", ":"))
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"Could not save cache index {self.index_path}: {e}")
+
+    def path_for(self, filename):
+        return os.path.join(self.cache_dir, filename)
+
+    def _add(self, filename, source, size, last_used):
+        # Caller holds the lock (or is still in __init__)
+        old = self._entries.get(filename)
+        if old is not None:
+            self._bytes -= old[1]
+            self._unlink_source(filename, old[0])
+        self._entries[filename] = [source, size, last_used]
+        self._bytes += size
+        if source is not None:
+            self._by_source.setdefault(source, set()).add(filename)
+
+    def _unlink_source(self, filename, source):
+        names = self._by_source.get(source)
+        if names is not None:
+            names.discard(filename)
+            if not names:
+                del self._by_source[source]
+
+    def record(self, path, source, last_used=None):
+        """Register a newly written cache file for `source` (used now, unless `last_used` says otherwise)"""
+        filename = os.path.basename(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            self._add(filename, source, size, time.time() if last_used is None else last_used)
+            self._dirty = True
+            over = self._bytes > self.max_bytes
+        if over:
+            self.evict()
+        self.save()
+
+    def touch(self, path, last_used=None):
+        """Mark a cache file as just used, or used at `last_used` (in memory only)"""
+        with self._lock:
+            entry = self._entries.get(os.path.basename(path))
+            if entry is not None:
+                entry[2] = time.time() if last_used is None else last_used
+
+    def recent_sources(self, count):
+        """Up to `count` sources of the most recently used entries, newest first"""
+        with self._lock:
+            entries = heapq.nlargest(count * 4, self._entries.values(), key=lambda e: e[2])
+        return list(dict.fromkeys(e[0] for e in entries))[:count]
+
+    def remove_source(self, source):
+        """Delete every cache entry derived from `source`"""
+        self.remove_sources([source])
+
+    def remove_sources(self, sources):
+        """Delete every cache entry derived from any of `sources`"""
+        with self._lock:
+            doomed = [fn for source in sources for fn in self._by_source.get(source, ())]
+        for filename in doomed:
+            self._remove(filename)
+
+    def _remove(self, filename):
+        try:
+            os.remove(self.path_for(filename))
+        except OSError:
+            pass
+        with self._lock:
+            entry = self._entries.pop(filename, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+                self._unlink_source(filename, entry[0])
+                self._dirty = True
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            total = self._bytes
+            if total <= self.max_bytes:
+                return
+            by_age = sorted(self._entries.items(), key=lambda item: item[1][2])
+            doomed = []
+            for filename, (_, size, _) in by_age:
+                if total <= self.max_bytes:
+                    break
+                doomed.append(filename)
+                total -= size
+        for filename in doomed:
+            self._remove(filename)
+        self.evictions += len(doomed)
+
+    def gc(self, is_current=None, source_for=None):
+        """Remove entries whose source is gone or whose key is stale, then enforce the size cap.
+
+        `is_current(source, filename)` says whether a cache file is still the one the
+        source would map to today. Files on disk the index doesn't know about (written by
+        another process, or before a crash) are adopted; `source_for(filename)` may name
+        their source, otherwise they are only subject to the size cap.
+        Returns the number of files removed.
+        """
+        removed = 0
+        try:
+            names = set(os.listdir(self.cache_dir))
+        except OSError:
+            return 0
+
+        with self._lock:
+            entries = list(self._entries.items())
+        for filename, (source, _, _) in entries:
+            if filename not in names:
+                # Deleted behind our back; just forget it
+                self._remove(filename)
+            elif source is None:
+                continue
+            elif not os.path.exists(source) or (is_current is not None and not is_current(source, filename)):
+                self._remove(filename)
+                removed += 1
+
+        for name in names:
+            if name == INDEX_NAME or name in self.ignore:
+                continue
+            if name.endswith(".tmp"):
+                # Leftover from a render that was killed part way through
+                try:
+                    if time.time() - os.path.getmtime(self.path_for(name)) > 3600:
+                        os.remove(self.path_for(name))
+                except OSError:
+                    pass
+                continue
+            with self._lock:
+                known = name in self._entries
+            if known:
+                continue
+            try:
+                st = os.stat(self.path_for(name))
+            except OSError:
+                continue
+            source = source_for(name) if source_for is not None else None
+            if source is not None and is_current is not None and not is_current(source, name):
+                try:
+                    os.remove(self.path_for(name))
+                    removed += 1
+                except OSError:
+                    pass
+                continue
+            with self._lock:
+                if name not in self._entries:
+                    self._add(name, source, st.st_size, st.st_mtime)
+                    self._dirty = True
+
+        before = self.evictions
+        self.evict()
+        removed += self.evictions - before
+        self.save(force=True)
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes, "evictions": self.evictions}
@@ -0,0 +1,151 @@
+"""Per-folder summaries for the web manager's folder view.
+
+Each folder shows how many images it holds, their total size, the newest
+one's date and a cover image, counting everything below it. The totals are
+built from one cached record per directory: the images directly in it and
+the names of its subdirectories. A record is only rebuilt when that
+directory's own mtime changes, so summarising an unchanged tree costs one
+stat() per directory below it.
+
+As with the media index, a file rewritten in place (same name, directory
+mtime unchanged) isn't noticed until its directory changes for another reason.
+
+Records are kept in memory and written to a JSON file under .cache/ at most
+every SAVE_SECONDS, so a restarted web manager doesn't re-list the tree.
+"""
+import os
+import json
+import time
+import threading
+from paths import CACHE_ROOT
+
+INDEX_PATH = os.path.join(CACHE_ROOT, "folder_index.json")
+SAVE_SECONDS = 60
+
+
+class FolderIndex:
+    """Cached summaries of the folders under `image_dir`; paths are relative to it"""
+
+    def __init__(self, image_dir, extensions, index_path=INDEX_PATH):
+        self.image_dir = image_dir
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.index_path = index_path
+        # rel_dir -> [mtime_ns, count, bytes, newest_mtime, newest_name, subdirs]
+        self._records = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+            if data.get("image_dir") == os.path.abspath(self.image_dir):
+                self._records = data["records"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def save(self, force=False):
+        """Write the records if they changed, at most every SAVE_SECONDS unless forced"""
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._saved_at < SAVE_SECONDS):
+                return
+            data = {"image_dir": os.path.abspath(self.image_dir), "records": dict(self._records)}
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"Could not save folder index {self.index_path}: {e}")
+
+    def _full_path(self, rel_dir):
+        return os.path.join(self.image_dir, rel_dir) if rel_dir else self.image_dir
+
+    def _is_image(self, name):
+        return name.lower().endswith(self.extensions)
+
+    def summary(self, rel_dir, mtime_ns=None):
+        """{"images", "bytes", "newest" (mtime), "cover" (rel path or None)} for everything under rel_dir.
+
+        `mtime_ns` is the directory's mtime if the caller already has it (e.g. from scandir).
+        """
+        summary = self._summarise(rel_dir, mtime_ns)
+        self.save()
+        count, size, newest, cover = summary
+        return {"images": count, "bytes": size, "newest": newest, "cover": cover}
+
+    def _summarise(self, rel_dir, mtime_ns=None):
+        # (count, bytes, newest_mtime, cover) of rel_dir and everything below it
+        record = self._record(rel_dir, mtime_ns)
+        if record is None:
+            return 0, 0, 0, None
+        _, count, size, newest, newest_name, subdirs = record
+        cover = (f"{rel_dir}/{newest_name}" if rel_dir else newest_name) if newest_name else None
+        for name in subdirs:
+            sub_count, sub_size, sub_newest, sub_cover = self._summarise(f"{rel_dir}/{name}" if rel_dir else name)
+            count += sub_count
+            size += sub_size
+            if sub_cover is not None and sub_newest > newest:
+                newest, cover = sub_newest, sub_cover
+        return count, size, newest, cover
+
+    def _record(self, rel_dir, mtime_ns=None):
+        # The directory's own record, re-listed if its mtime changed; None if it's gone
+        full_path = self._full_path(rel_dir)
+        if mtime_ns is None:
+            try:
+                mtime_ns = os.stat(full_path).st_mtime_ns
+            except OSError:
+                self._forget(rel_dir)
+                return None
+        with self._lock:
+            record = self._records.get(rel_dir)
+        if record is not None and record[0] == mtime_ns:
+            return record
+
+        count = size = newest = 0
+        newest_name = None
+        subdirs = []
+        try:
+            with os.scandir(full_path) as entries:
+                for entry in entries:
+                    try:
+                        # Symlinked directories aren't followed (a link to a parent would loop),
+                        # the same as in the media index
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif self._is_image(entry.name):
+                            st = entry.stat()
+                            count += 1
+                            size += st.st_size
+                            if st.st_mtime > newest:
+                                newest, newest_name = st.st_mtime, entry.name
+                    except OSError:
+                        continue
+        except OSError:
+            self._forget(rel_dir)
+            return None
+        record = [mtime_ns, count, size, newest, newest_name, sorted(subdirs)]
+        with self._lock:
+            # Subdirectories that disappeared take their records with them
+            if self._records.get(rel_dir) is not None:
+                for name in set(self._records[rel_dir][5]) - set(subdirs):
+                    self._forget_locked(f"{rel_dir}/{name}" if rel_dir else name)
+            self._records[rel_dir] = record
+            self._dirty = True
+        return record
+
+    def _forget(self, rel_dir):
+        with self._lock:
+            self._forget_locked(rel_dir)
+
+    def _forget_locked(self, rel_dir):
+        prefix = f"{rel_dir}/"
+        for key in [k for k in self._records if k == rel_dir or k.startswith(prefix)]:
+            del self._records[key]
+            self._dirty = True
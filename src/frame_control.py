@@ -0,0 +1,118 @@
+"""Local control channel between the web manager and the running frame.
+
+The frame listens on a Unix domain socket (TCP on localhost where Unix
+sockets aren't available). The protocol is one JSON object per line: a client
+connects, sends {"cmd": ..., ...args}, reads one JSON reply and disconnects.
+
+Commands: show (path), next, prev, pause, resume, reload, status. The frame
+executes them on its event loop, so a command takes effect as soon as the
+loop wakes up; every reply carries the frame's status afterwards.
+"""
+import os
+import json
+import socket
+import threading
+from paths import CACHE_ROOT
+
+SOCKET_PATH = os.path.join(CACHE_ROOT, "frame_control.sock")
+TCP_ADDRESS = ("127.0.0.1", 5001)   # used when AF_UNIX isn't available
+COMMANDS = ("show", "next", "prev", "pause", "resume", "reload", "status")
+TIMEOUT = 5.0                       # seconds to wait for the frame to act on a command
+MAX_MESSAGE_BYTES = 64 * 1024
+
+
+class FrameControlError(Exception):
+    """The frame isn't running, didn't answer in time, or rejected the command"""
+
+
+def _use_unix():
+    return hasattr(socket, "AF_UNIX")
+
+
+class ControlServer:
+    """Accepts commands and hands them to `dispatch(cmd, args) -> dict` (which may block until done)"""
+
+    def __init__(self, dispatch, socket_path=SOCKET_PATH, tcp_address=TCP_ADDRESS):
+        self.dispatch = dispatch
+        self.socket_path = socket_path
+        self.tcp_address = tcp_address
+        self._sock = None
+
+    def start(self):
+        if _use_unix():
+            os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+            # A socket left behind by a previous run would make bind() fail
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(self.socket_path)
+            os.chmod(self.socket_path, 0o660)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(self.tcp_address)
+        sock.listen(8)
+        self._sock = sock
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            conn.settimeout(TIMEOUT)
+            try:
+                request = json.loads(_read_line(conn))
+                cmd = request.pop("cmd", None)
+                if cmd not in COMMANDS:
+                    reply = {"ok": False, "error": f"unknown command {cmd!r}"}
+                else:
+                    reply = self.dispatch(cmd, request)
+            except (OSError, ValueError, AttributeError) as e:
+                reply = {"ok": False, "error": str(e)}
+            try:
+                conn.sendall(json.dumps(reply).encode("utf-8") + b"\n")
+            except OSError:
+                pass
+
+
+def _read_line(conn):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_MESSAGE_BYTES:
+            raise ValueError("message too long")
+    return data.decode("utf-8")
+
+
+def send_command(cmd, timeout=TIMEOUT, socket_path=SOCKET_PATH, tcp_address=TCP_ADDRESS, **args):
+    """Send one command to the frame and return its reply (a dict with "ok" and "status")"""
+    try:
+        if _use_unix():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = socket_path
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = tcp_address
+        with sock:
+            sock.settimeout(timeout)
+            sock.connect(address)
+            sock.sendall(json.dumps({"cmd": cmd, **args}).encode("utf-8") + b"\n")
+            reply = json.loads(_read_line(sock) or "null")
+    except (OSError, ValueError) as e:
+        raise FrameControlError(f"photo frame not reachable: {e}") from e
+    if not isinstance(reply, dict):
+        raise FrameControlError("photo frame closed the connection")
+    if not reply.get("ok"):
+        raise FrameControlError(reply.get("error") or "command failed")
+    return reply
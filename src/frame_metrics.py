@@ -0,0 +1,142 @@
+"""Runtime metrics of the frame process, for the web manager's /metrics page.
+
+The frame records timings (milliseconds) and counters into a fixed-size ring
+buffer, which is cheap enough to call on every image. A publisher thread
+periodically summarises the buffer (percentiles over the recent window,
+counter totals, gauges such as RSS and cache sizes) into a small JSON file
+under .cache/, which the web manager reads. A file rather than a socket keeps
+the web manager working when the frame isn't running: it just shows the
+last published numbers and how old they are.
+"""
+import os
+import json
+import time
+import threading
+from collections import deque
+from paths import CACHE_ROOT
+
+METRICS_PATH = os.path.join(CACHE_ROOT, "frame_metrics.json")
+RING_SIZE = 2048          # timing samples kept (shared by all timers)
+PUBLISH_SECONDS = 15      # how often the summary file is rewritten
+
+
+def process_rss_bytes():
+    """Resident set size of this process in bytes (Linux), or None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _summary(samples):
+    ordered = sorted(samples)
+    pick = lambda p: round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 1)
+    return {"count": len(ordered), "p50": pick(50), "p90": pick(90), "p99": pick(99),
+            "max": round(ordered[-1], 1), "last": round(samples[-1], 1)}
+
+
+class FrameMetrics:
+    """Ring buffer of timings plus counters and gauges, safe to use from any thread"""
+
+    def __init__(self, ring_size=RING_SIZE):
+        self._samples = deque(maxlen=ring_size)  # (time, name, milliseconds)
+        self._counters = {}
+        self._gauges = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def timing(self, name, ms):
+        self._samples.append((time.time(), name, ms))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def timer(self, name):
+        """Context manager that records the time spent in its block under `name`"""
+        return _Timer(self, name)
+
+    def add_collector(self, fn):
+        """Register fn() -> dict of gauges, called each time a snapshot is taken"""
+        self._collectors.append(fn)
+
+    def snapshot(self):
+        for fn in self._collectors:
+            try:
+                for name, value in fn().items():
+                    self.gauge(name, value)
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        self.gauge("rss_bytes", process_rss_bytes())
+
+        by_name = {}
+        for _, name, ms in list(self._samples):
+            by_name.setdefault(name, []).append(ms)
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        return {
+            "pid": os.getpid(),
+            "started": self.started,
+            "updated": time.time(),
+            "timings_ms": {name: _summary(samples) for name, samples in sorted(by_name.items())},
+            "counters": counters,
+            "gauges": gauges,
+        }
+
+    def publish(self, path=METRICS_PATH):
+        """Write a snapshot to `path` atomically"""
+        data = self.snapshot()
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write metrics to {path}: {e}")
+
+    def start_publisher(self, path=METRICS_PATH, interval=PUBLISH_SECONDS):
+        def run():
+            while True:
+                self.publish(path)
+                time.sleep(interval)
+        threading.Thread(target=run, daemon=True).start()
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.timing(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+def read_metrics(path=METRICS_PATH):
+    """Last published metrics (with their age in seconds as `age`), or None"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    data["age"] = round(time.time() - data.get("updated", 0), 1)
+    return data
+
+
+# Shared instance used by the frame
+metrics = FrameMetrics()
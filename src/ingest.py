@@ -0,0 +1,187 @@
+"""Background processing of uploaded images.
+
+Uploads are only written to a staging directory on the request path; a
+worker thread then, one file at a time:
+
+1. hashes the content and checks it against the media index,
+2. rejects a duplicate, or hard-links it to the existing copy if
+   DUPLICATES = "link",
+3. moves new files into the library atomically and records them (with their
+   hash and dimensions) in the index,
+4. runs the renderers (gallery thumbnail, frame-resolution thumbnail), so
+   the image is already warm when it first comes up.
+
+Staged files carry a small JSON sidecar with their target path, so uploads
+that were still queued when the web manager stopped are picked up again on
+the next start.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from collections import deque
+from PIL import Image
+from media_index import file_hash
+from paths import CACHE_ROOT
+
+STAGING_DIR = os.path.join(CACHE_ROOT, "ingest")
+DUPLICATES = "reject"   # "reject" drops re-uploads of a photo already in the library; "link" hard-links them
+RECENT_COUNT = 50       # finished uploads remembered for the status report
+
+
+class IngestQueue:
+    """Moves staged uploads into `image_dir` on a background thread.
+
+    `renderers` are called as fn(full_path, rel_path) for every new file; a
+    failing renderer is logged and doesn't stop the others.
+    """
+
+    def __init__(self, image_dir, index, renderers=(), staging_dir=STAGING_DIR, duplicates=DUPLICATES):
+        self.image_dir = image_dir
+        self.index = index
+        self.renderers = list(renderers)
+        self.staging_dir = staging_dir
+        self.duplicates = duplicates
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self.counts = {"queued": 0, "added": 0, "duplicates": 0, "linked": 0, "failed": 0}
+        self.recent = deque(maxlen=RECENT_COUNT)  # (rel_path, outcome, detail)
+        os.makedirs(staging_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._resume()
+
+    def submit(self, file_storage, rel_path):
+        """Stage an uploaded file (werkzeug FileStorage) for ingest under `rel_path`"""
+        staged = os.path.join(self.staging_dir, uuid.uuid4().hex)
+        file_storage.save(staged)
+        self._stage(staged, rel_path)
+
+    def submit_file(self, path, rel_path):
+        """Stage a complete file already on disk (e.g. a chunked upload), moving it, for ingest under `rel_path`"""
+        staged = os.path.join(self.staging_dir, uuid.uuid4().hex)
+        try:
+            os.replace(path, staged)
+        except OSError:
+            # On another filesystem than the staging dir
+            shutil.move(path, staged)
+        self._stage(staged, rel_path)
+
+    def _stage(self, staged, rel_path):
+        with open(f"{staged}.json", "w") as f:
+            json.dump({"rel_path": rel_path, "received": time.time()}, f)
+        self._enqueue(staged, rel_path)
+
+    def _resume(self):
+        # Re-queue uploads staged by a previous run (oldest first)
+        jobs = []
+        for name in os.listdir(self.staging_dir):
+            if not name.endswith(".json"):
+                continue
+            staged = os.path.join(self.staging_dir, name[:-len(".json")])
+            try:
+                with open(f"{staged}.json") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = None
+            if meta is None or not os.path.exists(staged):
+                self._discard(staged)
+                continue
+            jobs.append((meta.get("received", 0), staged, meta["rel_path"]))
+        for _, staged, rel_path in sorted(jobs):
+            self._enqueue(staged, rel_path)
+        if jobs:
+            print(f"Resuming ingest of {len(jobs)} staged upload(s)")
+
+    def _enqueue(self, staged, rel_path):
+        with self._cond:
+            self._queue.append((staged, rel_path))
+            self.counts["queued"] += 1
+            self._cond.notify()
+
+    def status(self):
+        with self._cond:
+            return {"pending": len(self._queue), **self.counts,
+                    "recent": [{"path": p, "outcome": o, "detail": d} for p, o, d in self.recent]}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                staged, rel_path = self._queue.popleft()
+            try:
+                outcome, detail = self._ingest(staged, rel_path)
+            except Exception as e:
+                outcome, detail = "failed", str(e)
+                print(f"Ingest of {rel_path} failed: {e}")
+            finally:
+                self._discard(staged)
+            with self._cond:
+                self.counts[outcome] += 1
+                self.recent.append((rel_path, outcome, detail))
+
+    def _discard(self, staged):
+        for path in (staged, f"{staged}.json"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _find_duplicate(self, digest, size, rel_path):
+        # Files copied in by hand may not be indexed yet, and hashes are filled in
+        # lazily (update_details_async); only a file of the same size can be a
+        # duplicate, so just those are hashed now
+        self.index.refresh()
+        self.index.update_details(size=size)
+        for existing in self.index.find_by_hash(digest):
+            if existing != rel_path and os.path.exists(os.path.join(self.image_dir, existing)):
+                return existing
+        return None
+
+    def _ingest(self, staged, rel_path):
+        full_path = os.path.join(self.image_dir, rel_path)
+        digest = file_hash(staged)
+        existing = self._find_duplicate(digest, os.path.getsize(staged), rel_path)
+        if existing is not None:
+            if self.duplicates != "link":
+                print(f"Upload {rel_path} is a duplicate of {existing}; skipped")
+                return "duplicates", existing
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            tmp_path = f"{full_path}.{uuid.uuid4().hex[:8]}.part"
+            os.link(os.path.join(self.image_dir, existing), tmp_path)
+            os.replace(tmp_path, full_path)
+            info = self.index.lookup(existing) or {}
+            self._record(rel_path, digest, info.get("width"), info.get("height"), info.get("format"))
+            return "linked", existing
+
+        width = height = fmt = None
+        try:
+            with Image.open(staged) as im:
+                width, height = im.size
+                fmt = im.format
+        except Exception:
+            pass
+
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        try:
+            os.replace(staged, full_path)
+        except OSError:
+            # Staging dir on another filesystem: copy next to the target, then rename
+            tmp_path = f"{full_path}.{uuid.uuid4().hex[:8]}.part"
+            shutil.copyfile(staged, tmp_path)
+            os.replace(tmp_path, full_path)
+        self._record(rel_path, digest, width, height, fmt)
+
+        for render in self.renderers:
+            try:
+                render(full_path, rel_path)
+            except Exception as e:
+                print(f"Could not pre-render {rel_path}: {e}")
+        return "added", None
+
+    def _record(self, rel_path, digest, width=None, height=None, fmt=None):
+        self.index.refresh_files([rel_path])
+        self.index.set_details(rel_path, digest, width, height, fmt)
@@ -0,0 +1,194 @@
+"""Watch the image directory and report added/removed images while running.
+
+On Linux the watcher uses inotify (through ctypes, no extra dependency) as
+a wake-up signal; everywhere else, or if inotify is unavailable, it falls
+back to polling. Either way the library is re-read with an incremental
+MediaIndex refresh, which only re-lists directories whose mtime changed.
+
+The index database is shared with the web manager, which may record a file
+(e.g. a processed upload) before the watcher gets to it, so changes are
+reported by diffing the index against the watcher's own snapshot rather
+than trusting what a refresh says it changed.
+"""
+import os
+import select
+import struct
+import threading
+import time
+import ctypes
+import ctypes.util
+from media_index import MediaIndex
+
+POLL_SECONDS = 30        # polling fallback interval
+DEBOUNCE_SECONDS = 1.0   # gather bursts of events (e.g. bulk uploads) into one refresh
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class _Inotify:
+    """Minimal recursive inotify wrapper"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # watch descriptor -> directory
+
+    def add_tree(self, directory):
+        for root, dirs, files in os.walk(directory):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {root}")
+            self.watches[wd] = root
+
+    def read(self, timeout):
+        """Return a list of (directory, name, mask) events, waiting at most `timeout` seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        buf = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            events.append((self.watches.get(wd), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher:
+    """Calls on_change(added, removed) with full image paths whenever the library changes.
+
+    The callback runs on the watcher thread.
+    """
+
+    def __init__(self, directory, extensions, on_change, poll_seconds=POLL_SECONDS):
+        self.directory = directory
+        self.on_change = on_change
+        self.poll_seconds = poll_seconds
+        self.index = MediaIndex(directory, extensions)
+        self._known = self.index.snapshot()  # rel path -> (size, mtime) as last reported
+        self._lock = threading.Lock()        # refresh_now() may run alongside the watcher thread
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _diff(self):
+        # (added, removed) since the last call; files that changed are in both
+        current = self.index.snapshot()
+        added = [p for p, state in current.items() if self._known.get(p) != state]
+        removed = [p for p, state in self._known.items() if current.get(p) != state]
+        self._known = current
+        return added, removed
+
+    def _refresh(self, rewritten=()):
+        with self._lock:
+            self.index.refresh()
+            if rewritten:
+                self.index.refresh_files(rewritten)
+            changes = self._diff()
+        self._report(*changes)
+
+    def refresh_now(self):
+        """Rescan right away on the calling thread and return (added, removed) full paths.
+
+        The changes are returned instead of being passed to on_change.
+        """
+        with self._lock:
+            self.index.refresh()
+            added, removed = self._diff()
+        return self._full(added), self._full(removed)
+
+    def _full(self, paths):
+        return [os.path.join(self.directory, p) for p in paths]
+
+    def _report(self, added, removed):
+        if not added and not removed:
+            return
+        try:
+            self.on_change(self._full(added), self._full(removed))
+        except Exception as e:
+            print(f"Library change handler failed: {e}")
+
+    def _run(self):
+        # Catch anything that changed between the initial scan and now
+        try:
+            self._refresh()
+        except Exception as e:
+            print(f"Library refresh failed: {e}")
+        try:
+            inotify = _Inotify()
+            inotify.add_tree(self.directory)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}); polling {self.directory} every {self.poll_seconds}s")
+            self._poll()
+            return
+        try:
+            self._watch(inotify)
+        finally:
+            inotify.close()
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self._refresh()
+            except Exception as e:
+                print(f"Library refresh failed: {e}")
+
+    def _watch(self, inotify):
+        while not self._stop.is_set():
+            events = inotify.read(timeout=1.0)
+            if not events:
+                continue
+            # Let a burst of events settle before refreshing once
+            deadline = time.monotonic() + DEBOUNCE_SECONDS
+            while time.monotonic() < deadline:
+                events.extend(inotify.read(timeout=max(0, deadline - time.monotonic())))
+
+            rewritten = set()
+            for directory, name, mask in events:
+                if directory is None:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        inotify.add_tree(path)
+                    except OSError as e:
+                        print(f"Could not watch {path}: {e}")
+                elif mask & IN_CLOSE_WRITE:
+                    # A file rewritten in place doesn't change its directory's mtime
+                    rewritten.add(os.path.relpath(path, self.directory))
+
+            try:
+                self._refresh(rewritten)
+            except Exception as e:
+                print(f"Library refresh failed: {e}")
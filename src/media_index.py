@@ -0,0 +1,320 @@
+"""Shared on-disk index of the photo library.
+
+Both the frame and the web manager read the library through this index
+instead of walking the whole tree. The index lives in a small SQLite
+database under .cache/ and is refreshed incrementally: a directory is only
+re-listed when its own mtime changed, so a refresh of an unchanged library
+costs one stat() per directory.
+
+Files that are rewritten in place (same name, directory mtime unchanged)
+are not noticed until their directory changes for another reason.
+"""
+import os
+import stat
+import sqlite3
+import hashlib
+import threading
+from PIL import Image
+from paths import CACHE_ROOT
+
+INDEX_PATH = os.path.join(CACHE_ROOT, "media_index.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    width INTEGER,
+    height INTEGER,
+    format TEXT,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+CREATE INDEX IF NOT EXISTS files_mtime ON files(mtime);
+CREATE INDEX IF NOT EXISTS files_path_nocase ON files(path COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS files_hash ON files(hash);
+"""
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path):
+    """SHA-1 of a file's contents, read in chunks"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class MediaIndex:
+    """Incrementally refreshed index of the images under `image_dir`.
+
+    Paths handed out by the index are relative to `image_dir`.
+    """
+
+    def __init__(self, image_dir, extensions, db_path=INDEX_PATH):
+        self.image_dir = image_dir
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.db_path = db_path
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        self._details_thread = None
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._check_root(conn)
+            self._local.conn = conn
+        return conn
+
+    def _check_root(self, conn):
+        # An index built for a different image directory is useless; start over
+        root = os.path.abspath(self.image_dir)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'image_dir'").fetchone()
+        if row is not None and row["value"] == root:
+            return
+        with conn:
+            conn.execute("DELETE FROM files")
+            conn.execute("DELETE FROM dirs")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('image_dir', ?)", (root,))
+
+    def _full_path(self, rel_path):
+        return os.path.join(self.image_dir, rel_path) if rel_path else self.image_dir
+
+    def _is_image(self, name):
+        return name.lower().endswith(self.extensions)
+
+    def refresh(self):
+        """Bring the index up to date. Returns (added, removed) lists of relative paths.
+
+        Files whose size or mtime changed are reported in both lists. Each directory
+        is written in its own short transaction, so the other process's refresh (or a
+        reader) never waits on a whole first scan of a large library.
+        """
+        with self._refresh_lock:
+            return self._refresh(self._connect())
+
+    def _refresh(self, conn):
+        stored = {}
+        children = {}
+        for row in conn.execute("SELECT path, parent, mtime_ns FROM dirs"):
+            stored[row["path"]] = row["mtime_ns"]
+            if row["parent"] is not None:
+                children.setdefault(row["parent"], []).append(row["path"])
+
+        added, removed = [], []
+        seen_dirs = set()
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                # A symlinked subdirectory (indexed before, or swapped in since) counts as gone;
+                # the library root itself may be a link
+                st = os.lstat(self._full_path(rel_dir)) if rel_dir else os.stat(self.image_dir)
+            except OSError:
+                continue
+            if stat.S_ISLNK(st.st_mode):
+                continue
+            dir_mtime = st.st_mtime_ns
+            seen_dirs.add(rel_dir)
+
+            if stored.get(rel_dir) == dir_mtime:
+                # Directory listing unchanged: trust the stored files, but still visit subdirs
+                stack.extend(children.get(rel_dir, []))
+                continue
+
+            subdirs = []
+            entries = {}
+            try:
+                with os.scandir(self._full_path(rel_dir)) as it:
+                    for entry in it:
+                        rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                        try:
+                            # Like os.walk, don't follow symlinked directories (a link to a parent loops)
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(rel_path)
+                            elif self._is_image(entry.name) and entry.is_file():
+                                st = entry.stat()
+                                entries[rel_path] = (st.st_size, st.st_mtime)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+            with conn:
+                existing = {
+                    row["path"]: (row["size"], row["mtime"])
+                    for row in conn.execute("SELECT path, size, mtime FROM files WHERE dir = ?", (rel_dir,))
+                }
+                gone = existing.keys() - entries.keys()
+                removed.extend(gone)
+                conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in gone])
+
+                changed = []
+                for path, (size, mtime) in entries.items():
+                    old = existing.get(path)
+                    if old == (size, mtime):
+                        continue
+                    if old is not None:
+                        removed.append(path)
+                    added.append(path)
+                    changed.append((path, rel_dir, size, mtime))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO files (path, dir, size, mtime) VALUES (?, ?, ?, ?)", changed)
+
+                conn.execute("INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                             (rel_dir, os.path.dirname(rel_dir) if rel_dir else None, dir_mtime))
+            stack.extend(subdirs)
+
+        # Directories that disappeared take their files with them
+        for rel_dir in stored.keys() - seen_dirs:
+            with conn:
+                removed.extend(row["path"] for row in
+                               conn.execute("SELECT path FROM files WHERE dir = ?", (rel_dir,)))
+                conn.execute("DELETE FROM files WHERE dir = ?", (rel_dir,))
+                conn.execute("DELETE FROM dirs WHERE path = ?", (rel_dir,))
+
+        return added, removed
+
+    def refresh_files(self, rel_paths):
+        """Re-stat individual files, e.g. ones rewritten in place. Returns (added, removed)."""
+        added, removed = [], []
+        with self._refresh_lock:
+            conn = self._connect()
+            with conn:
+                for path in rel_paths:
+                    row = conn.execute("SELECT size, mtime FROM files WHERE path = ?", (path,)).fetchone()
+                    old = (row["size"], row["mtime"]) if row is not None else None
+                    try:
+                        st = os.stat(self._full_path(path))
+                        new = (st.st_size, st.st_mtime)
+                    except OSError:
+                        new = None
+                    if not self._is_image(path) or old == new:
+                        continue
+                    if old is not None:
+                        removed.append(path)
+                        conn.execute("DELETE FROM files WHERE path = ?", (path,))
+                    if new is not None:
+                        added.append(path)
+                        conn.execute("INSERT INTO files (path, dir, size, mtime) VALUES (?, ?, ?, ?)",
+                                     (path, os.path.dirname(path), new[0], new[1]))
+        return added, removed
+
+    def update_details(self, limit=None, size=None):
+        """Fill in dimensions, format and content hash for files that don't have them yet.
+
+        With `size`, only files of exactly that many bytes are done (the only ones
+        that can be a duplicate of a file that size). Returns the number of files updated.
+        """
+        conn = self._connect()
+        query = "SELECT path, size, mtime FROM files WHERE hash IS NULL"
+        args = ()
+        if size is not None:
+            query += " AND size = ?"
+            args = (int(size),)
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        rows = conn.execute(query, args).fetchall()
+        updated = 0
+        for row in rows:
+            full_path = self._full_path(row["path"])
+            try:
+                digest = file_hash(full_path)
+                width = height = fmt = None
+                try:
+                    with Image.open(full_path) as im:
+                        width, height = im.size
+                        fmt = im.format
+                except Exception:
+                    pass
+            except OSError:
+                continue
+            with conn:
+                # Only write back if the file wasn't replaced while we were hashing it
+                conn.execute(
+                    "UPDATE files SET width = ?, height = ?, format = ?, hash = ? "
+                    "WHERE path = ? AND size = ? AND mtime = ?",
+                    (width, height, fmt, digest, row["path"], row["size"], row["mtime"]))
+            updated += 1
+        return updated
+
+    def set_details(self, rel_path, digest, width=None, height=None, fmt=None):
+        """Store details computed elsewhere (e.g. during upload) so they aren't computed twice"""
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE files SET width = ?, height = ?, format = ?, hash = ? WHERE path = ?",
+                         (width, height, fmt, digest, rel_path))
+
+    def update_details_async(self):
+        """Run update_details() on a background thread unless one is already running"""
+        if self._details_thread is not None and self._details_thread.is_alive():
+            return
+        self._details_thread = threading.Thread(target=self.update_details, daemon=True)
+        self._details_thread.start()
+
+    def paths(self):
+        """All indexed image paths, sorted"""
+        return [row["path"] for row in self._connect().execute("SELECT path FROM files ORDER BY path")]
+
+    def snapshot(self):
+        """{path: (size, mtime)} for every indexed file, for diffing against a later state"""
+        rows = self._connect().execute("SELECT path, size, mtime FROM files")
+        return {row["path"]: (row["size"], row["mtime"]) for row in rows}
+
+    def files(self, sort_by="name"):
+        """All indexed files as dicts, sorted by name or by date (newest first)"""
+        order = "mtime DESC, path" if sort_by == "date" else "path COLLATE NOCASE, path"
+        rows = self._connect().execute(f"SELECT * FROM files ORDER BY {order}")
+        return [dict(row) for row in rows]
+
+    def files_page(self, sort_by="name", limit=100, after=None):
+        """Up to `limit` files in files() order, starting after `after` (the last dict of the previous page).
+
+        Pages are keyset-based, so each one costs the same however deep into the
+        library it is, and files added or removed meanwhile don't shift later pages.
+        """
+        if sort_by == "date":
+            order = "mtime DESC, path"
+            where = "WHERE mtime < ? OR (mtime = ? AND path > ?)"
+            args = (after["mtime"], after["mtime"], after["path"]) if after else ()
+        else:
+            order = "path COLLATE NOCASE, path"
+            where = "WHERE path > ? COLLATE NOCASE OR (path = ? COLLATE NOCASE AND path > ?)"
+            args = (after["path"], after["path"], after["path"]) if after else ()
+        query = f"SELECT * FROM files {where if after else ''} ORDER BY {order} LIMIT ?"
+        rows = self._connect().execute(query, args + (int(limit),))
+        return [dict(row) for row in rows]
+
+    def count(self):
+        """Number of indexed files"""
+        return self._connect().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def lookup(self, rel_path):
+        """Index entry for one file as a dict, or None"""
+        row = self._connect().execute("SELECT * FROM files WHERE path = ?", (rel_path,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def find_by_hash(self, digest):
+        """Relative paths of files whose content hash is `digest`"""
+        rows = self._connect().execute("SELECT path FROM files WHERE hash = ?", (digest,))
+        return [row["path"] for row in rows]
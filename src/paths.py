@@ -0,0 +1,10 @@
+"""Where the frame and the web manager keep their caches and runtime state.
+
+Both processes share some of it (the media index, the control socket, the
+frame's thumbnails shown in the web manager), so they must agree on
+CACHE_ROOT: the project's .cache directory, or PHOTO_FRAME_CACHE_DIR if set.
+"""
+import os
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CACHE_ROOT = os.environ.get("PHOTO_FRAME_CACHE_DIR") or os.path.join(ROOT_DIR, ".cache")
@@ -0,0 +1,296 @@
+"""Playback order for the frame: a fair shuffle with bounded, persistent history.
+
+The library is one list of paths, split in place into the photos not shown
+yet in the current cycle (front) and the ones already shown (back). The next
+photo is drawn at random from the front part and swapped to the back, so
+every photo comes up once per cycle and the least recently shown always go
+first. Early in a new cycle, photos that were among the last shown (up to
+half the library) are redrawn, so a cycle doesn't open with the photo that
+closed the last one.
+
+Back / forward navigation uses a fixed-size ring of the photos shown last,
+so months of uptime don't grow memory. The ring, the position in it and the
+shown-this-cycle set are saved to a small JSON file (the set as 8-byte path
+hashes), so a restart resumes the same cycle instead of reshuffling.
+restore() reads the history without the library, so the frame can put the
+last photo back on screen before its library scan has finished.
+"""
+import os
+import json
+import time
+import base64
+import random
+import hashlib
+from collections import deque
+from paths import CACHE_ROOT
+
+STATE_PATH = os.path.join(CACHE_ROOT, "playback.json")
+HISTORY_SIZE = 500        # photos remembered for the back gesture
+SAVE_SECONDS = 600        # minimum time between state writes (SD card wear)
+DIGEST_SIZE = 8
+RECENT_RETRIES = 8        # redraws when the pick was shown recently (start of a cycle)
+
+
+def _digest(rel_path):
+    return hashlib.blake2b(rel_path.encode("utf-8", "surrogateescape"), digest_size=DIGEST_SIZE).digest()
+
+
+class PlaybackScheduler:
+    """Decides what the frame shows next; not thread-safe (the frame's event loop owns it)"""
+
+    def __init__(self, directory, state_path=STATE_PATH, history_size=HISTORY_SIZE):
+        self.directory = directory
+        self.state_path = state_path
+        self.paths = []                 # the library; paths[:self._unseen] not shown this cycle
+        self._unseen = 0
+        self.history = deque(maxlen=history_size)
+        self._cursor = -1               # index in history of the photo on screen
+        self._upcoming = deque()        # drawn from the library but not shown yet
+        self.cycle = 0
+        self._saved = None              # (stored side, digests) read by restore(), merged by load()
+        self._prefix = os.path.join(directory, "")
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _rel(self, path):
+        if path.startswith(self._prefix):
+            return path[len(self._prefix):]
+        return os.path.relpath(path, self.directory)
+
+    # ---------------------- navigation ----------------------
+
+    def current(self):
+        return self.history[self._cursor] if self._cursor >= 0 else None
+
+    def forward(self):
+        """Step forward: back through photos we went back from, else a new one"""
+        if self._cursor < len(self.history) - 1:
+            self._cursor += 1
+            self._dirty = True
+            return self.current()
+        return self.advance()
+
+    def advance(self):
+        """Show a new photo (auto-advance); forgets any photos we went back from"""
+        path = self._upcoming.popleft() if self._upcoming else self._draw()
+        if path is not None:
+            self._push(path)
+        return path
+
+    def back(self):
+        """Step back in history; None when there's nothing further back"""
+        if self._cursor <= 0:
+            return None
+        self._cursor -= 1
+        self._dirty = True
+        return self.current()
+
+    def show(self, path):
+        """Show `path` out of turn; it counts as shown for this cycle"""
+        if path in self._upcoming:
+            self._upcoming.remove(path)
+        else:
+            self._mark_shown(path)
+        self._push(path)
+
+    def peek(self, count):
+        """The next `count` photos going forward, without moving"""
+        ahead = [self.history[i] for i in range(self._cursor + 1, min(len(self.history), self._cursor + 1 + count))]
+        while len(ahead) + len(self._upcoming) < count and len(self._upcoming) < len(self.paths):
+            path = self._draw()
+            if path is None:
+                break
+            self._upcoming.append(path)
+        ahead.extend(list(self._upcoming)[:count - len(ahead)])
+        return ahead
+
+    def behind(self, count):
+        """The `count` photos before the current one, nearest first"""
+        return [self.history[i] for i in range(self._cursor - 1, max(-1, self._cursor - 1 - count), -1)]
+
+    def prerender_order(self):
+        """Every photo once, in roughly the order they'll come up.
+
+        Pre-render keeps the front of this list when the library doesn't fit in the
+        thumbnail cache, so the photos coming up soonest are the last to be evicted.
+        """
+        ahead = list(self.history)[self._cursor + 1:] + list(self._upcoming)
+        queued = set(ahead)
+        return ahead + [p for p in self.paths if p not in queued]
+
+    def _push(self, path):
+        # Drop whatever was ahead of the cursor, then make `path` current
+        while len(self.history) > self._cursor + 1:
+            self.history.pop()
+        self.history.append(path)
+        self._cursor = len(self.history) - 1
+        self._dirty = True
+
+    def _draw(self):
+        # Pick a random photo not shown this cycle and move it to the shown part
+        if not self.paths:
+            return None
+        if self._unseen == 0:
+            self.cycle += 1
+            self._unseen = len(self.paths)
+        recent = self._recent()
+        for _ in range(RECENT_RETRIES):
+            i = random.randrange(self._unseen)
+            if self.paths[i] not in recent:
+                break
+        # Never straight after itself, even if every retry missed (small libraries)
+        previous = self._upcoming[-1] if self._upcoming else self.current()
+        if self.paths[i] == previous and self._unseen > 1:
+            i = (i + random.randrange(1, self._unseen)) % self._unseen
+        self._unseen -= 1
+        last = self._unseen
+        self.paths[i], self.paths[last] = self.paths[last], self.paths[i]
+        self._dirty = True
+        return self.paths[last]
+
+    def _recent(self):
+        # Photos shown or queued most recently, at most half the library, and always the one on screen
+        limit = len(self.paths) // 2
+        recent = set(self._upcoming)
+        if self._cursor >= 0:
+            recent.add(self.current())
+        for path in reversed(self.history):
+            if len(recent) >= limit:
+                break
+            recent.add(path)
+        return recent
+
+    def _move_to_shown(self, shown):
+        i = 0
+        while i < self._unseen and shown:
+            if self.paths[i] in shown:
+                self._unseen -= 1
+                self.paths[i], self.paths[self._unseen] = self.paths[self._unseen], self.paths[i]
+            else:
+                i += 1
+
+    def _mark_shown(self, path):
+        try:
+            i = self.paths.index(path)
+        except ValueError:
+            return
+        if i < self._unseen:
+            self._unseen -= 1
+            self.paths[i], self.paths[self._unseen] = self.paths[self._unseen], self.paths[i]
+            self._dirty = True
+
+    # ---------------------- library changes ----------------------
+
+    def add(self, paths):
+        """Add new photos (they haven't been shown this cycle); returns the ones actually new"""
+        known = set(self.paths)
+        added = []
+        for path in paths:
+            if path in known:
+                continue
+            known.add(path)
+            self.paths.append(path)
+            self.paths[-1], self.paths[self._unseen] = self.paths[self._unseen], self.paths[-1]
+            self._unseen += 1
+            added.append(path)
+        if added:
+            self._dirty = True
+        return added
+
+    def remove(self, paths):
+        """Forget deleted photos everywhere, keeping the cursor on the same photo where possible"""
+        removed = set(paths)
+        if not removed:
+            return
+        unseen = [p for p in self.paths[:self._unseen] if p not in removed]
+        self.paths[:] = unseen + [p for p in self.paths[self._unseen:] if p not in removed]
+        self._unseen = len(unseen)
+        self._upcoming = deque(p for p in self._upcoming if p not in removed)
+
+        before = sum(1 for i in range(self._cursor + 1) if self.history[i] in removed)
+        self.history = deque((p for p in self.history if p not in removed), maxlen=self.history.maxlen)
+        self._cursor = min(max(self._cursor - before, 0), len(self.history) - 1)
+        self._dirty = True
+
+    # ---------------------- persistence ----------------------
+
+    def restore(self):
+        """Read the saved history before the library is known; True if there was a saved state.
+
+        Navigation works on the restored history right away; call load() once the
+        library has been scanned.
+        """
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            self._saved = (state["stored"], base64.b64decode(state["digests"]))
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        # Files deleted while the frame was off can't be shown
+        full = lambda rel_paths: [os.path.join(self.directory, r) for r in rel_paths]
+        history = full(state.get("history", []))
+        cursor = state.get("cursor", len(history) - 1)
+        kept = [p for p in history if os.path.isfile(p)]
+        # The cursor moves back by the entries dropped at or before it, so it stays on the same photo
+        # (or the one before it, if that was deleted); a smaller history_size drops the oldest too
+        dropped = sum(1 for p in history[:cursor + 1] if not os.path.isfile(p))
+        dropped += max(0, len(kept) - self.history.maxlen)
+        self.history.extend(kept)
+        self._cursor = min(max(cursor - dropped, 0), len(self.history) - 1)
+        self._upcoming.extend(p for p in full(state.get("upcoming", [])) if os.path.isfile(p))
+        self.cycle = state.get("cycle", 0)
+        return True
+
+    def load(self, paths):
+        """Take over `paths` as the library, merging in the restored state"""
+        self.paths = paths
+        self._unseen = len(paths)
+        if self._saved is not None:
+            # Partition the library by the saved shown-this-cycle set
+            stored, digests = self._saved
+            self._saved = None
+            digests = {digests[i:i + DIGEST_SIZE] for i in range(0, len(digests), DIGEST_SIZE)}
+            want = stored == "shown"
+            skip = len(self._prefix)   # paths come from os.path.join(directory, rel_path)
+            self._move_to_shown({p for p in paths if (_digest(p[skip:]) in digests) == want})
+        else:
+            # Whatever was shown before the library came in counts for this cycle
+            self._move_to_shown(set(self.history) | set(self._upcoming))
+
+        library = set(paths)
+        self.remove([p for p in set(self.history) | set(self._upcoming) if p not in library])
+        self._dirty = True
+
+    def save(self, force=False):
+        """Write the state if it changed, at most every SAVE_SECONDS unless forced"""
+        if self._saved is not None:
+            # The library isn't loaded yet; the saved cycle hasn't been merged in
+            return
+        if not self._dirty or (not force and time.monotonic() - self._saved_at < SAVE_SECONDS):
+            return
+        # Store whichever side of the cycle is smaller
+        stored = "shown" if len(self.paths) - self._unseen <= self._unseen else "unseen"
+        side = self.paths[self._unseen:] if stored == "shown" else self.paths[:self._unseen]
+        state = {
+            "cycle": self.cycle,
+            "history": [self._rel(p) for p in self.history],
+            "cursor": self._cursor,
+            "upcoming": [self._rel(p) for p in self._upcoming],
+            "stored": stored,
+            "digests": base64.b64encode(b"".join(_digest(self._rel(p)) for p in side)).decode("ascii"),
+            "saved": time.time(),
+        }
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(state, f, separators=(",", ":"))
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            print(f"Could not save playback state to {self.state_path}: {e}")
+            return
+        self._dirty = False
+        self._saved_at = time.monotonic()
@@ -0,0 +1,32 @@
+"""Process pool behind thumbnails.prerender(), run as its own small script.
+
+Pool workers started with "spawn" re-import the parent's __main__. Run from
+the frame, that is Rpi-Photo-Frame.py: pygame, the caches and the playback
+state in every worker. Here the parent is this script, which only imports
+thumbnails, and on Linux the workers are forked from it without importing
+anything again.
+
+Reads jobs from stdin, one JSON list [src_path, dst_path, screen_size, fmt]
+per line, and writes one line per job, in order: whether it was rendered.
+
+    python src/prerender_pool.py <workers>
+"""
+import sys
+import json
+import signal
+import multiprocessing
+import thumbnails
+
+
+def main():
+    workers = int(sys.argv[1])
+    # Stopped by the frame: exit through the pool's cleanup, which stops the workers too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+    jobs = ((src, dst, tuple(size), fmt) for src, dst, size, fmt in map(json.loads, sys.stdin))
+    with multiprocessing.Pool(workers, initializer=thumbnails._prerender_init) as pool:
+        for rendered in pool.imap(thumbnails._prerender_one, jobs):
+            print(json.dumps(rendered), flush=True)
+
+
+if __name__ == "__main__":
+    main()
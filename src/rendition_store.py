@@ -0,0 +1,187 @@
+"""Screen-sized renditions built once by the web manager for every frame that shows the library.
+
+Each frame registers its screen size and thumbnail format. The web manager
+keeps those registrations in a small JSON file (the registry), builds a
+rendition of every photo for each one into a shared store directory, and
+serves them from /rendition/<W>x<H>/<path>. A frame with RENDITION_SOURCE
+set copies ready-made renditions into its own thumbnail cache rather than
+decoding originals. The source is either the web manager's URL or the store
+directory itself (mounted over NFS/SMB, or just local).
+
+Store files are named from the photo's path relative to the library, its
+mtime, the size and the format. So the web manager and a frame that mounts
+the library somewhere else still agree on the names.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from paths import CACHE_ROOT
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+STORE_DIR = os.path.join(CACHE_ROOT, "frame_renditions")
+REGISTRY_NAME = "frames.json"
+REGISTRY_LOCK_NAME = "frames.json.lock"
+MAX_FRAMES = 8                 # registered frames; each one means a rendition of the whole library
+MAX_SIDE = 3840                # largest screen width/height accepted...
+MAX_PIXELS = 3840 * 2160       # ...and largest screen area (4K), so one rendition stays a few MB even raw
+FORGET_SECONDS = 30 * 86400    # frames not seen for this long drop out of the registry
+FETCH_TIMEOUT = 15.0           # seconds; a miss is rendered on the spot, which takes a while on a Pi
+
+
+class RegistryError(Exception):
+    """Invalid or refused frame registration"""
+
+
+def size_name(size):
+    return f"{size[0]}x{size[1]}"
+
+
+def parse_size(text):
+    """(width, height) from "WxH"; ValueError if malformed or out of range"""
+    width, height = (int(v) for v in text.lower().split("x"))
+    if not (0 < width <= MAX_SIDE and 0 < height <= MAX_SIDE and width * height <= MAX_PIXELS):
+        raise ValueError(f"screen size out of range: {text}")
+    return width, height
+
+
+def rendition_name(rel_path, mtime, size, fmt="jpeg"):
+    """Store filename for one photo at one size, independent of where the library is mounted"""
+    rel_path = rel_path.replace(os.sep, "/")
+    key = hashlib.sha1(f"{rel_path}-{int(mtime)}-{fmt}".encode("utf-8")).hexdigest()
+    ext = ".jpg" if fmt == "jpeg" else ".raw"
+    return f"{size_name(size)}-{key}{ext}"
+
+
+class FrameRegistry:
+    """Frames known to the web manager, kept in REGISTRY_NAME inside the store directory.
+
+    The file is re-read on every call, so all web workers (and frames writing to a
+    shared store directly) see the same registrations.
+    """
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self.path = os.path.join(store_dir, REGISTRY_NAME)
+        self._lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+
+    def frames(self):
+        """{name: {"size": [w, h], "format": fmt, "last_seen": epoch}}"""
+        try:
+            with open(self.path) as f:
+                frames = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return frames if isinstance(frames, dict) else {}
+
+    def targets(self):
+        """Distinct (size, format) pairs to build renditions for"""
+        return sorted({(tuple(f["size"]), f.get("format", "jpeg")) for f in self.frames().values()})
+
+    def is_target(self, size, fmt):
+        return (tuple(size), fmt) in self.targets()
+
+    def register(self, name, size, fmt="jpeg"):
+        """Add a frame, or update its size/format and last-seen time"""
+        if not name or len(name) > 64:
+            raise RegistryError("frame name must be 1-64 characters")
+        if fmt != "jpeg" and not fmt.startswith("raw-"):
+            raise RegistryError(f"unsupported format {fmt!r}")
+        try:
+            size = parse_size(size_name(size))
+        except (TypeError, ValueError) as e:
+            raise RegistryError(str(e)) from e
+        with self._lock, _FileLock(os.path.join(self.store_dir, REGISTRY_LOCK_NAME)):
+            frames = self.frames()
+            now = time.time()
+            frames = {n: f for n, f in frames.items() if now - f.get("last_seen", 0) < FORGET_SECONDS}
+            if name not in frames and len(frames) >= MAX_FRAMES:
+                raise RegistryError(f"too many frames registered (max {MAX_FRAMES})")
+            frames[name] = {"size": list(size), "format": fmt, "last_seen": now}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(frames, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+class _FileLock:
+    # Exclusive lock across processes (no-op without fcntl)
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o660)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            os.close(self._fd)
+        return False
+
+
+# ---------------------- frame side ----------------------
+
+def _is_url(source):
+    return source.startswith(("http://", "https://"))
+
+
+def register(source, name, size, fmt="jpeg", token=None, timeout=FETCH_TIMEOUT):
+    """Register this frame with the web manager at `source` (URL or store directory).
+    A URL needs `token`, the contents of the web manager's config/frame_token."""
+    if not _is_url(source):
+        FrameRegistry(source).register(name, size, fmt)
+        return
+    body = json.dumps({"name": name, "width": size[0], "height": size[1], "format": fmt}).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    req = urllib.request.Request(f"{source.rstrip('/')}/api/frames/register", data=body, headers=headers)
+    with urllib.request.urlopen(req, timeout=timeout):
+        pass
+
+
+def fetch(source, rel_path, mtime, size, fmt, dst_path, ready_only=False, token=None, timeout=FETCH_TIMEOUT):
+    """Copy the rendition of `rel_path` to dst_path; False if the source doesn't have it.
+
+    The web manager renders a missing rendition on request unless `ready_only`,
+    and only for callers with the frame `token`; a store directory only has
+    what's been built. Other errors raise OSError.
+    """
+    tmp_path = f"{dst_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        if _is_url(source):
+            url = (f"{source.rstrip('/')}/rendition/{size_name(size)}/"
+                   f"{urllib.parse.quote(rel_path.replace(os.sep, '/'))}?fmt={fmt}")
+            if ready_only:
+                url += "&ready=1"
+            headers = {"Authorization": f"Bearer {token}"} if token else {}
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response, open(tmp_path, "wb") as f:
+                    shutil.copyfileobj(response, f)
+            except urllib.error.HTTPError as e:
+                if e.code in (404, 503):
+                    return False
+                raise
+        else:
+            try:
+                shutil.copyfile(os.path.join(source, rendition_name(rel_path, mtime, size, fmt)), tmp_path)
+            except FileNotFoundError:
+                return False
+        os.replace(tmp_path, dst_path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,79 @@
+"""Production entry point for the web manager.
+
+Runs web_manager.app under gunicorn with threaded workers (gthread). Static
+responses (/image, cached thumbnails) are handed to the kernel with
+sendfile(), and Flask's send_file handles Range and conditional
+(ETag / If-Modified-Since) requests. Debug mode and the reloader are off.
+
+    python src/serve.py --workers 1 --threads 8 --bind 0.0.0.0:5000
+
+Settings can also come from the environment (WEB_BIND, WEB_WORKERS,
+WEB_THREADS, WEB_TIMEOUT), which is handy in a systemd unit. Keep one worker
+process unless the Pi has RAM to spare: threads share the upload ingest
+queue, and thumbnail rendering mostly runs outside the GIL anyway. With more
+workers, the first one to serve a request maintains the disk caches (their
+index files, garbage collection and size caps); the others only render into
+them.
+
+Without gunicorn (e.g. on a Windows development machine) this falls back to
+Werkzeug's threaded server, still with debug off.
+"""
+import os
+import argparse
+
+DEFAULT_BIND = "0.0.0.0:5000"
+DEFAULT_WORKERS = 1
+DEFAULT_THREADS = 8
+DEFAULT_TIMEOUT = 120   # seconds; large uploads over a slow link take a while
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the photo frame web manager")
+    parser.add_argument("--bind", default=os.environ.get("WEB_BIND", DEFAULT_BIND))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_WORKERS", DEFAULT_WORKERS)),
+                        help="worker processes")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("WEB_THREADS", DEFAULT_THREADS)),
+                        help="request threads per worker")
+    parser.add_argument("--timeout", type=int, default=int(os.environ.get("WEB_TIMEOUT", DEFAULT_TIMEOUT)))
+    return parser.parse_args(argv)
+
+
+def serve_gunicorn(app, args):
+    from gunicorn.app.base import BaseApplication
+
+    class WebManagerApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", [args.bind])
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("threads", args.threads)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("timeout", args.timeout)
+            self.cfg.set("sendfile", True)
+            self.cfg.set("accesslog", None)
+
+        def load(self):
+            return app
+
+    WebManagerApplication().run()
+
+
+def serve_werkzeug(app, args):
+    host, _, port = args.bind.rpartition(":")
+    print("gunicorn is not installed; using Werkzeug's threaded server instead")
+    app.run(host=host or "0.0.0.0", port=int(port), debug=False, use_reloader=False, threaded=True)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from web_manager import app
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        serve_werkzeug(app, args)
+        return
+    print(f"Serving web manager on {args.bind} ({args.workers} worker(s) x {args.threads} threads)")
+    serve_gunicorn(app, args)
+
+
+if __name__ == "__main__":
+    main()
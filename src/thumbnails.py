@@ -0,0 +1,282 @@
+"""Screen-sized thumbnail cache used by the frame.
+
+Kept separate from the pygame UI so process-pool workers can import it
+cheaply. prerender() fills the cache for a whole library in the background,
+with a pool run by prerender_pool.py so no worker ever loads the UI.
+
+Thumbnails come in two formats:
+
+- "jpeg": quality-85 JPEG, small on the SD card but decoded on every load
+- "raw-<layout>": display-ready pixels behind a 16-byte header (RAW_HEADER),
+  which the frame maps into memory and converts without any codec step.
+  The layout is picked to match the display (see RAW_LAYOUTS), so that
+  conversion is a plain copy.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import struct
+import hashlib
+import threading
+import subprocess
+import decode
+from work_scheduler import work, lower_priority
+
+PRERENDER_NICE = 10           # niceness of pre-render workers
+PRERENDER_MAX_WORKERS = 3     # upper bound on pool size (None = all free cores)
+PRERENDER_REPORT_SECONDS = 10 # how often to log / write progress
+PRERENDER_RANK_SECONDS = 0.001  # last-used step between consecutive thumbnails of a pass (see prerender)
+PRERENDER_POOL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prerender_pool.py")
+
+RAW_MAGIC = b"RPF1"
+RAW_HEADER = struct.Struct("<4s4sII")  # magic, layout, width, height; pixels follow
+# layout -> (Pillow raw mode, pygame.image.frombuffer format, bytes per pixel).
+# The X byte of BGRX is read as alpha by pygame and dropped by convert().
+RAW_LAYOUTS = {
+    "RGB": ("RGB", "RGB", 3),
+    "RGBX": ("RGBX", "RGBX", 4),
+    "BGRX": ("BGRX", "BGRA", 4),
+}
+
+
+def thumbnail_prefix_for(image_path):
+    # All cached thumbnails of one source share this prefix, so they can be found
+    # (and dropped) even after the source file is gone
+    return hashlib.sha1(image_path.encode("utf-8")).hexdigest()[:16]
+
+
+def thumbnail_path_for(cache_dir, image_path, screen_size, fmt="jpeg"):
+    # Use path + mtime + screen size (+ raw layout) to generate a cache filename
+    try:
+        mtime = int(os.path.getmtime(image_path))
+    except OSError:
+        mtime = 0
+    key = f"{image_path}-{mtime}-{screen_size[0]}x{screen_size[1]}"
+    if fmt != "jpeg":
+        key += f"-{fmt}"
+    h = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    ext = ".jpg" if fmt == "jpeg" else ".raw"
+    return os.path.join(cache_dir, f"{thumbnail_prefix_for(image_path)}-{h}{ext}")
+
+
+def write_raw(im, path, layout):
+    # Write `im` as display-ready pixels in `layout` (see RAW_LAYOUTS)
+    rawmode = RAW_LAYOUTS[layout][0]
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    with open(path, "wb") as f:
+        f.write(RAW_HEADER.pack(RAW_MAGIC, layout.encode("ascii").ljust(4), im.width, im.height))
+        f.write(im.tobytes("raw", rawmode))
+
+
+def read_raw_header(buf):
+    # (layout, (width, height)) of a raw thumbnail; ValueError if it's damaged
+    if len(buf) < RAW_HEADER.size:
+        raise ValueError("raw thumbnail too short")
+    magic, layout, width, height = RAW_HEADER.unpack_from(buf)
+    layout = layout.decode("ascii", "replace").strip()
+    if magic != RAW_MAGIC or layout not in RAW_LAYOUTS:
+        raise ValueError("not a raw thumbnail")
+    if len(buf) < RAW_HEADER.size + width * height * RAW_LAYOUTS[layout][2]:
+        raise ValueError("raw thumbnail truncated")
+    return layout, (width, height)
+
+
+def create_thumbnail(src_path, dst_path, screen_size, fmt="jpeg"):
+    # Create a small cached version of the image that fits screen_size.
+    # decode.open_for_screen picks the cheapest decode route for the format
+    # (embedded preview, DCT scaling, reduce) and applies EXIF orientation.
+    # The file is written to a temp file and renamed into place, so readers never
+    # see a half-written thumbnail.
+    tmp_path = f"{dst_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        im = decode.open_for_screen(src_path, screen_size)
+        if fmt == "jpeg":
+            # save with reasonable quality to reduce size
+            im.save(tmp_path, format="JPEG", quality=85, optimize=True)
+        else:
+            write_raw(im, tmp_path, fmt[len("raw-"):])
+        os.replace(tmp_path, dst_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    # encourage GC after heavy operations
+    gc.collect()
+
+
+def free_cores():
+    # Cores not already busy, always leaving one for the slideshow itself
+    cores = os.cpu_count() or 1
+    try:
+        busy = int(round(os.getloadavg()[0]))
+    except (AttributeError, OSError):
+        busy = 0
+    workers = max(1, cores - 1 - busy)
+    if PRERENDER_MAX_WORKERS:
+        workers = min(workers, PRERENDER_MAX_WORKERS)
+    return workers
+
+
+def _prerender_init():
+    # Pool initializer: run workers at low priority so the UI always wins
+    if hasattr(os, "nice"):
+        try:
+            os.nice(PRERENDER_NICE)
+        except OSError:
+            pass
+    lower_priority(nice=0)  # idle I/O class as well
+
+
+def _prerender_one(job):
+    # Pool worker: render one thumbnail. Returns True if it was rendered.
+    src_path, dst_path, screen_size, fmt = job
+    if os.path.exists(dst_path):
+        return False
+    try:
+        # A slot shared with the web manager's rendering; waits while the frame loads a slide
+        with work.background(label=f"prerender {os.path.basename(src_path)}"):
+            if os.path.exists(dst_path):
+                return False
+            create_thumbnail(src_path, dst_path, screen_size, fmt)
+        return True
+    except Exception:
+        return False
+
+
+def _write_progress(progress_file, progress):
+    if not progress_file:
+        return
+    tmp_path = f"{progress_file}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, progress_file)
+    except OSError:
+        pass
+
+
+def prerender(paths, cache_dir, screen_size, progress_file=None, stop_event=None, cache=None, fmt="jpeg",
+              max_bytes=None):
+    # Render thumbnails for every path (in order) that isn't cached yet, using a
+    # nice'd process pool sized to the free cores. Already-cached files are skipped,
+    # so an interrupted run simply resumes where it stopped.
+    # With `max_bytes`, the pass stops at the first thumbnail that doesn't fit in that
+    # many bytes (counting the cached ones before it): rendering further would only
+    # make the cache evict the thumbnails at the front of `paths`, the ones shown next.
+    # Progress (done/total, images per second) is logged and written to progress_file.
+    # New thumbnails are registered with `cache` (a DiskCache) if given, and every kept
+    # one gets a last-used time that decreases along `paths`, so the cache's LRU
+    # eviction drops the end of the order first and the upcoming photos last.
+    planned = []
+    for path in paths:
+        dst = thumbnail_path_for(cache_dir, path, screen_size, fmt)
+        try:
+            size = os.path.getsize(dst)
+        except OSError:
+            size = None   # not rendered yet
+        planned.append((path, dst, size))
+    jobs = [(path, dst, tuple(screen_size), fmt) for path, dst, size in planned if size is None]
+
+    total = len(paths)
+    done = total - len(jobs)
+    progress = {"total": total, "done": done, "rendered": 0, "images_per_second": 0.0,
+                "finished": not jobs, "over_budget": False, "updated": time.time()}
+    workers = free_cores()
+    start = last_report = time.time()
+    pool = None
+    results = 0       # pool results read so far
+    used = kept = 0   # bytes and count of the thumbnails this pass keeps
+    try:
+        for rank, (path, dst, size) in enumerate(planned):
+            last_used = start - rank * PRERENDER_RANK_SECONDS
+            if size is None:
+                if max_bytes is not None and kept and used + used / kept > max_bytes:
+                    # An average thumbnail wouldn't fit either; don't render one just to drop it
+                    progress["over_budget"] = True
+                    break
+                if pool is None:
+                    print(f"Pre-rendering {len(jobs)} of {total} thumbnails with {workers} worker(s)")
+                    pool = _start_pool(jobs, workers)
+                # One result line per job, in order; none if the pool died
+                line = pool.stdout.readline()
+                if not line:
+                    break
+                results += 1
+                done += 1
+                rendered = json.loads(line)
+                progress["rendered"] += int(rendered)
+                try:
+                    size = os.path.getsize(dst) if rendered else 0
+                except OSError:
+                    size = 0
+                if max_bytes is not None and used + size > max_bytes:
+                    _remove_file(dst)
+                    progress["over_budget"] = True
+                    break
+                if rendered and cache is not None:
+                    cache.record(dst, path, last_used)
+            elif max_bytes is not None and used + size > max_bytes:
+                progress["over_budget"] = True
+                break
+            elif cache is not None:
+                cache.touch(dst, last_used)
+            used += size
+            kept += bool(size)
+            now = time.time()
+            if stop_event is not None and stop_event.is_set():
+                break
+            if now - last_report >= PRERENDER_REPORT_SECONDS:
+                last_report = now
+                progress.update(done=done, updated=now,
+                                images_per_second=round(progress["rendered"] / max(now - start, 1e-6), 2))
+                print(f"Pre-render: {done}/{total} ({progress['images_per_second']} img/s)")
+                _write_progress(progress_file, progress)
+    finally:
+        if pool is not None:
+            if results < len(jobs):
+                pool.terminate()
+            pool.wait()
+            pool.stdout.close()
+            if progress["over_budget"]:
+                # Thumbnails the workers finished after the cut are over the budget too
+                for _, dst, _, _ in jobs[results:]:
+                    _remove_file(dst)
+
+    progress["finished"] = results == len(jobs) or progress["over_budget"]
+    progress["done"] = done
+    progress["updated"] = time.time()
+    if progress["over_budget"]:
+        print(f"Pre-render stopped at the cache budget: the first {kept} of {total} thumbnails "
+              f"({used // (1024 * 1024)} MB) are kept")
+    elif jobs and progress["finished"]:
+        progress["images_per_second"] = round(progress["rendered"] / max(time.time() - start, 1e-6), 2)
+        print(f"Pre-render: {done}/{total} ({progress['images_per_second']} img/s)")
+    _write_progress(progress_file, progress)
+    return progress
+
+
+def _start_pool(jobs, workers):
+    # The pool runs in its own process (prerender_pool.py): workers must not inherit
+    # the UI's threads / SDL state, nor re-import the frame script as spawned workers do
+    pool = subprocess.Popen([sys.executable, PRERENDER_POOL_SCRIPT, str(workers)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+
+    def feed():
+        try:
+            for job in jobs:
+                pool.stdin.write(json.dumps(job) + "\n")
+            pool.stdin.close()
+        except (OSError, ValueError):
+            pass  # pool stopped early
+
+    threading.Thread(target=feed, daemon=True).start()
+    return pool
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,14 +1,36 @@
 import os
 import platform
 import shutil
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, send_file, session, flash
+import hashlib
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, send_file, session, flash, jsonify
 from werkzeug.utils import secure_filename
-from werkzeug.security import check_password_hash, generate_password_hash
-from PIL import Image
-from io import BytesIO
+from werkzeug.security import check_password_hash, generate_password_hash, safe_join
 import pillow_heif
 import datetime
 import json
+import base64
+import atexit
+import secrets
+import functools
+import time
+import threading
+from media_index import MediaIndex
+from folder_index import FolderIndex
+from disk_cache import DiskCache
+from ingest import IngestQueue
+from chunked_upload import UploadSessions, UploadError
+import decode
+import frame_metrics
+import frame_control
+import thumbnails
+import rendition_store
+from work_scheduler import work, Busy
+from paths import CACHE_ROOT
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 pillow_heif.register_heif_opener()
 
@@ -20,6 +42,52 @@ else:
 
 SUPPORTED_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp", ".heic"]
 
+# Gallery thumbnails are cached on disk so each original is only decoded once
+THUMB_CACHE_DIR = os.path.join(CACHE_ROOT, "web_thumbs")
+THUMB_CACHE_MAX_BYTES = 256 * 1024 * 1024
+THUMB_SIZE = (200, 200)
+GALLERY_PAGE_SIZE = 60     # images per gallery page / /api/images request
+GALLERY_MAX_PAGE_SIZE = 500
+thumb_cache = DiskCache(THUMB_CACHE_DIR, THUMB_CACHE_MAX_BYTES, read_only=True)
+
+# "View size" renditions served by /image instead of the original, in a size-capped cache
+RENDITION_CACHE_DIR = os.path.join(CACHE_ROOT, "renditions")
+RENDITION_CACHE_MAX_BYTES = 512 * 1024 * 1024
+RENDITION_WIDTHS = (480, 800, 1200, 1600, 2048)  # requested widths are rounded up to one of these
+RENDITION_DEFAULT_WIDTH = 1600
+RENDITION_MAX_HEIGHT = 4096
+RENDITION_FORMATS = {  # ?fmt= -> (PIL format, mimetype, extension, save options)
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', 'image/webp', '.webp', {'quality': 80, 'method': 4}),
+}
+rendition_cache = DiskCache(RENDITION_CACHE_DIR, RENDITION_CACHE_MAX_BYTES, read_only=True)
+
+# One web manager process (the first to claim WEB_CACHE_LOCK_PATH) writes the disk caches'
+# indexes, garbage-collects them and enforces their size caps; see claim_web_caches
+WEB_CACHE_LOCK_PATH = os.path.join(CACHE_ROOT, "web_caches.lock")
+WEB_CACHE_GC_SECONDS = 6 * 3600
+
+# Rendering shares the CPU with the slideshow (see work_scheduler); a request that can't get
+# a render slot this quickly gets 503 + Retry-After instead of queueing up
+THUMB_WAIT_SECONDS = 1.0
+RENDITION_WAIT_SECONDS = 3.0
+
+# The frame's screen-sized thumbnail cache, warmed for new uploads
+FRAME_THUMB_DIR = os.path.join(CACHE_ROOT, "thumbs")
+
+# Screen-sized renditions for every registered frame (see rendition_store), built once
+# here and served from /rendition so other frames don't decode originals themselves
+FRAME_RENDITION_DIR = rendition_store.STORE_DIR
+FRAME_RENDITION_MAX_BYTES = 4 * 1024 * 1024 * 1024
+frame_renditions = DiskCache(FRAME_RENDITION_DIR, FRAME_RENDITION_MAX_BYTES, read_only=True,
+                             ignore=(rendition_store.REGISTRY_NAME, rendition_store.REGISTRY_LOCK_NAME))
+frame_registry = rendition_store.FrameRegistry(FRAME_RENDITION_DIR)
+
+# Shared with the photo frame; refreshed incrementally on each listing
+media_index = MediaIndex(IMAGE_DIR, SUPPORTED_EXTENSIONS)
+# Image count, size, newest date and cover of each folder, re-listed only when a directory changes
+folder_index = FolderIndex(IMAGE_DIR, SUPPORTED_EXTENSIONS)
+
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = IMAGE_DIR
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB limit for multiple files
@@ -47,6 +115,25 @@ def save_users(users):
 # Load users at startup
 USERS = load_users()
 
+# Frames register for renditions with this shared token (see rendition_store); created on first use
+FRAME_TOKEN_FILE = os.path.join(os.path.dirname(__file__), '..', 'config', 'frame_token')
+
+@functools.lru_cache(maxsize=None)
+def frame_token():
+    """The frame registration token, generated and saved if there isn't one yet"""
+    try:
+        with open(FRAME_TOKEN_FILE) as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except OSError:
+        pass
+    token = secrets.token_urlsafe(24)
+    os.makedirs(os.path.dirname(FRAME_TOKEN_FILE), exist_ok=True)
+    with open(FRAME_TOKEN_FILE, 'w') as f:
+        f.write(token + '\n')
+    return token
+
 def login_required(f):
     def decorated_function(*args, **kwargs):
         if not USERS:
@@ -65,25 +152,303 @@ def secure_path(path):
     parts = path.replace('\\', '/').split('/')
     secured_parts = []
     for part in parts:
-        if part:  # skip empty parts
-            secured_parts.append(secure_filename(part))
+        part = secure_filename(part)
+        if part:  # skip empty parts, including ones like '..' that secure to nothing
+            secured_parts.append(part)
     return '/'.join(secured_parts)
 
-def collect_images(directory, base_path=""):
-    """Recursively collect all image files with their dates"""
-    images = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if allowed_file(file):
-                rel_path = os.path.relpath(os.path.join(root, file), directory)
-                full_path = os.path.join(directory, rel_path)
+def format_date(mtime):
+    return datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M')
+
+def format_size(size):
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'bytes' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def encode_cursor(entry):
+    """Opaque pagination cursor pointing just past `entry`"""
+    raw = json.dumps([entry['path'], entry['mtime']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; None for a missing or malformed cursor"""
+    try:
+        path, mtime = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return {'path': str(path), 'mtime': float(mtime)}
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def list_images(sort_by='name', cursor=None, limit=GALLERY_PAGE_SIZE):
+    """One page of library images sorted by name or date. Returns (images, next_cursor)."""
+    after = decode_cursor(cursor) if cursor else None
+    if after is None:
+        # Only the first page re-scans the library, so scrolling stays cheap
+        media_index.refresh()
+        # Dimensions and content hashes are filled in off the request path
+        media_index.update_details_async()
+        # ...and so are renditions of files added by hand, for every registered frame
+        for size, fmt in frame_registry.targets():
+            start_frame_renditions(size, fmt)
+    entries = media_index.files_page(sort_by, limit + 1, after)
+    next_cursor = encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+    images = [{'path': entry['path'], 'date': format_date(entry['mtime']),
+               'width': entry['width'], 'height': entry['height']}
+              for entry in entries[:limit]]
+    return images, next_cursor
+
+def thumb_key(rel_path, st):
+    """Cache key for a gallery thumbnail: source path + mtime + size + thumbnail size"""
+    key = f"{rel_path}-{st.st_mtime_ns}-{st.st_size}-{THUMB_SIZE[0]}x{THUMB_SIZE[1]}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def thumb_is_current(source, filename):
+    """Whether a thumb_cache file is the gallery thumbnail `source` maps to today"""
+    try:
+        st = os.stat(source)
+    except OSError:
+        return False
+    return filename == f"{thumb_key(os.path.relpath(source, IMAGE_DIR), st)}.jpg"
+
+def create_thumb(src_path, dst_path):
+    """Render a gallery thumbnail and move it into place atomically"""
+    tmp_path = f"{dst_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        # Cheapest decode route for the format, EXIF orientation applied, RGB for JPEG
+        im = decode.open_for_screen(src_path, THUMB_SIZE)
+        im.save(tmp_path, 'JPEG', quality=85)
+        os.replace(tmp_path, dst_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def rendition_width(requested):
+    """Round a requested width up to one of RENDITION_WIDTHS, so the cache only holds a few sizes per image"""
+    for width in RENDITION_WIDTHS:
+        if requested <= width:
+            return width
+    return RENDITION_WIDTHS[-1]
+
+def create_rendition(src_path, dst_path, width, fmt):
+    """Render a view-size rendition and move it into place atomically"""
+    pil_format, _, _, options = RENDITION_FORMATS[fmt]
+    tmp_path = f"{dst_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        im = decode.open_for_screen(src_path, (width, RENDITION_MAX_HEIGHT))
+        im.save(tmp_path, pil_format, **options)
+        os.replace(tmp_path, dst_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def rendition_key(rel_path, st, width, fmt):
+    """Cache key for a view-size rendition: source path + mtime + size + width + format"""
+    return hashlib.sha1(f"{rel_path}-{st.st_mtime_ns}-{st.st_size}-{width}-{fmt}".encode('utf-8')).hexdigest()
+
+def rendition_is_current(source, filename):
+    """Whether a rendition_cache file is one of the renditions `source` maps to today"""
+    try:
+        st = os.stat(source)
+    except OSError:
+        return False
+    rel_path = os.path.relpath(source, IMAGE_DIR)
+    return any(filename == f"{rendition_key(rel_path, st, width, fmt)}{RENDITION_FORMATS[fmt][2]}"
+               for width in RENDITION_WIDTHS for fmt in RENDITION_FORMATS)
+
+def ensure_rendition(full_path, rel_path, st, width, fmt, wait=None):
+    """Path and cache key of the `fmt` rendition of an image at `width`, rendering it if needed.
+    Raises Busy if no render slot frees up within `wait` seconds."""
+    ext = RENDITION_FORMATS[fmt][2]
+    key = rendition_key(rel_path, st, width, fmt)
+    path = rendition_cache.path_for(f"{key}{ext}")
+    if os.path.exists(path):
+        rendition_cache.touch(path)
+        return path, key
+    work.run(create_rendition, full_path, path, width, fmt, wait=wait, label=f"rendition {rel_path}")
+    rendition_cache.record(path, full_path)
+    return path, key
+
+def ensure_thumb(rel_path, st, wait=None):
+    """Path and cache key of the gallery thumbnail for `rel_path`, rendering it if needed.
+    Raises Busy if no render slot frees up within `wait` seconds."""
+    key = thumb_key(rel_path, st)
+    thumb_path = thumb_cache.path_for(f"{key}.jpg")
+    if os.path.exists(thumb_path):
+        thumb_cache.touch(thumb_path)
+        return thumb_path, key
+    full_path = os.path.join(IMAGE_DIR, rel_path)
+    work.run(create_thumb, full_path, thumb_path, wait=wait, label=f"thumb {rel_path}")
+    thumb_cache.record(thumb_path, full_path)
+    return thumb_path, key
+
+def frame_rendition_is_current(source, filename):
+    """Whether a frame_renditions file is the rendition of `source` for a frame registered today"""
+    try:
+        mtime = os.path.getmtime(source)
+    except OSError:
+        return False
+    rel_path = os.path.relpath(source, IMAGE_DIR)
+    return any(filename == rendition_store.rendition_name(rel_path, mtime, size, fmt)
+               for size, fmt in frame_registry.targets())
+
+def frame_rendition_path(rel_path, st, size, fmt):
+    return frame_renditions.path_for(rendition_store.rendition_name(rel_path, st.st_mtime, size, fmt))
+
+def ensure_frame_rendition(full_path, rel_path, st, size, fmt, urgent=False):
+    """Path of the rendition of an image for a registered frame size and format, rendering it if needed.
+    `urgent`: a frame is waiting to show it, so it goes ahead of all background work."""
+    path = frame_rendition_path(rel_path, st, size, fmt)
+    if os.path.exists(path):
+        frame_renditions.touch(path)
+        return path
+    if urgent:
+        with work.urgent():
+            thumbnails.create_thumbnail(full_path, path, size, fmt)
+    else:
+        work.run(thumbnails.create_thumbnail, full_path, path, size, fmt,
+                 label=f"frame rendition {rendition_store.size_name(size)} {rel_path}")
+    frame_renditions.record(path, full_path)
+    return path
+
+_frame_builds = {}
+_frame_builds_lock = threading.Lock()
+
+def build_frame_renditions(size, fmt):
+    """Render the whole library for one frame size and format; cheap when most renditions exist"""
+    media_index.refresh()
+    built = failed = 0
+    for rel_path in media_index.paths():
+        full_path = os.path.join(IMAGE_DIR, rel_path)
+        try:
+            st = os.stat(full_path)
+            if not os.path.exists(frame_rendition_path(rel_path, st, size, fmt)):
+                ensure_frame_rendition(full_path, rel_path, st, size, fmt)
+                built += 1
+        except Exception as e:
+            failed += 1
+            print(f"Could not build {rendition_store.size_name(size)} rendition of {rel_path}: {e}")
+    frame_renditions.save(force=True)
+    print(f"Frame renditions {rendition_store.size_name(size)} {fmt}: {built} built, {failed} failed")
+
+def start_frame_renditions(size, fmt):
+    """Run build_frame_renditions in the background unless a build for that target is already running"""
+    with _frame_builds_lock:
+        thread = _frame_builds.get((size, fmt))
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=build_frame_renditions, args=(size, fmt), daemon=True)
+        _frame_builds[(size, fmt)] = thread
+        thread.start()
+
+# Disk caches the web manager maintains: name -> (cache, is_current for DiskCache.gc)
+web_caches = {
+    'thumbs': (thumb_cache, thumb_is_current),
+    'renditions': (rendition_cache, rendition_is_current),
+    'frame renditions': (frame_renditions, frame_rendition_is_current),
+}
+_web_caches_fd = None
+_web_caches_thread = None
+_web_caches_lock = threading.Lock()
+
+def claim_web_caches():
+    """True if this process maintains the web caches, claiming them if no other process has.
+
+    Under gunicorn every worker renders into the same caches, but only the owner
+    writes their index files and runs gc; it adopts the other workers' files.
+    """
+    global _web_caches_fd
+    with _web_caches_lock:
+        if _web_caches_fd is not None:
+            return True
+        os.makedirs(os.path.dirname(WEB_CACHE_LOCK_PATH), exist_ok=True)
+        fd = os.open(WEB_CACHE_LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o660)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+        _web_caches_fd = fd
+    for cache, _ in web_caches.values():
+        cache.read_only = False
+    # Entries recorded since the last periodic save would otherwise drop out of the index
+    atexit.register(save_web_caches)
+    return True
+
+def save_web_caches():
+    """Write the web caches' indexes now (owner only)"""
+    for cache, _ in web_caches.values():
+        cache.save(force=True)
+
+def maintain_web_caches():
+    """Garbage-collect the web caches now and every WEB_CACHE_GC_SECONDS; runs forever.
+    A process that isn't the owner keeps trying, in case the owner exits."""
+    while True:
+        if claim_web_caches():
+            for name, (cache, is_current) in web_caches.items():
                 try:
-                    mtime = os.path.getmtime(full_path)
-                    date_str = datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M')
-                except OSError:
-                    date_str = 'Unknown'
-                images.append({'path': rel_path, 'date': date_str})
-    return images
+                    removed = cache.gc(is_current)
+                    stats = cache.stats()
+                    print(f"Web cache {name}: removed {removed}, {stats['entries']} files, "
+                          f"{stats['bytes'] // (1024 * 1024)} MB of {stats['max_bytes'] // (1024 * 1024)} MB")
+                except Exception as e:
+                    print(f"Web cache {name} cleanup failed: {e}")
+        time.sleep(WEB_CACHE_GC_SECONDS)
+
+@app.before_request
+def start_web_cache_maintenance():
+    """Start maintain_web_caches on the first request, so it runs in the serving process (not a gunicorn arbiter)"""
+    global _web_caches_thread
+    if _web_caches_thread is not None:
+        return
+    with _web_caches_lock:
+        if _web_caches_thread is None:
+            _web_caches_thread = threading.Thread(target=maintain_web_caches, daemon=True)
+            _web_caches_thread.start()
+
+def busy_response(e):
+    """503 telling the client when to try again, for requests turned away by the work scheduler"""
+    return "Busy rendering, try again shortly", 503, {'Retry-After': str(e.retry_after)}
+
+def prerender_web_thumb(full_path, rel_path):
+    """Ingest renderer: gallery thumbnail"""
+    ensure_thumb(rel_path, os.stat(full_path))
+
+def prerender_frame_thumb(full_path, rel_path):
+    """Ingest renderer: the frame's screen-sized thumbnail (screen size and format as last reported by the frame)"""
+    data = frame_metrics.read_metrics()
+    screen = data and data['gauges'].get('screen')
+    if not screen:
+        return  # frame hasn't run yet; its own pre-render pass will cover this file
+    fmt = data['gauges'].get('thumbnail_format', 'jpeg')
+    # The frame keys thumbnails by IMAGE_DIR-joined paths, same as full_path
+    dst_path = thumbnails.thumbnail_path_for(FRAME_THUMB_DIR, full_path, screen, fmt)
+    if not os.path.exists(dst_path):
+        os.makedirs(FRAME_THUMB_DIR, exist_ok=True)
+        work.run(thumbnails.create_thumbnail, full_path, dst_path, tuple(screen), fmt,
+                 label=f"frame thumb {rel_path}")
+
+def prerender_frame_renditions(full_path, rel_path):
+    """Ingest renderer: renditions for every registered frame"""
+    st = os.stat(full_path)
+    for size, fmt in frame_registry.targets():
+        ensure_frame_rendition(full_path, rel_path, st, size, fmt)
+
+# Resumable chunked uploads (see chunked_upload); committed files go through the ingest queue
+upload_sessions = UploadSessions()
+
+_ingest_queue = None
+_ingest_lock = threading.Lock()
+
+def ingest_queue():
+    """The upload ingest queue, started on first use (so only the serving process runs it)"""
+    global _ingest_queue
+    with _ingest_lock:
+        if _ingest_queue is None:
+            _ingest_queue = IngestQueue(IMAGE_DIR, media_index,
+                                        renderers=[prerender_web_thumb, prerender_frame_thumb,
+                                                   prerender_frame_renditions])
+        return _ingest_queue
 
 @app.route('/setup', methods=['GET', 'POST'])
 def setup():
@@ -209,47 +574,44 @@ def index(current_path=''):
     sort_by = request.args.get('sort', 'name')
     
     if view == 'gallery':
-        images = collect_images(IMAGE_DIR)
-        if sort_by == 'name':
-            images.sort(key=lambda x: x['path'].lower())
-        elif sort_by == 'date':
-            images.sort(key=lambda x: os.path.getmtime(os.path.join(IMAGE_DIR, x['path'])), reverse=True)
-        return render_template('gallery.html', images=images, sort_by=sort_by)
+        # First page is rendered inline; the page fetches the rest from /api/images as you scroll
+        images, next_cursor = list_images(sort_by)
+        return render_template('gallery.html', images=images, sort_by=sort_by,
+                               next_cursor=next_cursor, total=media_index.count())
     
     # Folder view
     full_path = os.path.join(IMAGE_DIR, current_path)
-    if not os.path.exists(full_path):
+    if not os.path.isdir(full_path):
         return "Not found", 404
     
+    # One stat per entry (scandir caches it); folder totals come from folder_index
     items = []
     try:
-        for item in os.listdir(full_path):
-            item_path = os.path.join(full_path, item)
-            rel_path = os.path.join(current_path, item) if current_path else item
-            try:
-                mtime = os.path.getmtime(item_path)
-                date_str = datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M')
-            except OSError:
-                date_str = 'Unknown'
-            if os.path.isdir(item_path):
-                items.append({'name': item, 'type': 'folder', 'path': rel_path, 'date': date_str})
-            elif allowed_file(item):
-                items.append({'name': item, 'type': 'file', 'path': rel_path, 'date': date_str})
+        with os.scandir(full_path) as entries:
+            for entry in entries:
+                rel_path = os.path.join(current_path, entry.name) if current_path else entry.name
+                try:
+                    is_dir = entry.is_dir()
+                    if not is_dir and not allowed_file(entry.name):
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                item = {'name': entry.name, 'type': 'folder' if is_dir else 'file', 'path': rel_path,
+                        'mtime': st.st_mtime, 'date': format_date(st.st_mtime)}
+                if is_dir:
+                    item.update(folder_index.summary(rel_path.replace(os.sep, '/'), st.st_mtime_ns))
+                    item['size'] = format_size(item['bytes'])
+                    item['newest_date'] = format_date(item['newest']) if item['images'] else None
+                items.append(item)
     except PermissionError:
         return "Permission denied", 403
     
-    # Sort items
-    if sort_by == 'name':
+    # Sort items: folders first, then by name or by date (newest first)
+    if sort_by == 'date':
+        items.sort(key=lambda x: (x['type'] == 'file', -x['mtime']))
+    else:
         items.sort(key=lambda x: (x['type'] == 'file', x['name'].lower()))
-    elif sort_by == 'date':
-        def get_sort_key(item):
-            item_full_path = os.path.join(IMAGE_DIR, item['path'])
-            try:
-                mtime = os.path.getmtime(item_full_path)
-            except OSError:
-                mtime = 0
-            return (item['type'] == 'file', -mtime)  # folders first, then by date descending
-        items.sort(key=get_sort_key)
     
     return render_template('index.html', items=items, current_path=current_path, sort_by=sort_by)
 
@@ -262,13 +624,102 @@ def upload():
         for file in files:
             if file.filename:
                 rel_path = secure_path(file.filename)
-                if rel_path:  # skip if empty after securing
-                    full_path = os.path.join(IMAGE_DIR, rel_path)
-                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
-                    file.save(full_path)
+                if rel_path and allowed_file(rel_path):  # skip if empty after securing
+                    # Hashing, dedup and thumbnails happen in the background
+                    ingest_queue().submit(file, rel_path)
                     uploaded_count += 1
         return redirect(url_for('index'))
-    return render_template('upload.html')
+    return render_template('upload.html', ingest=ingest_queue().status(),
+                           supported_extensions=SUPPORTED_EXTENSIONS)
+
+def upload_error(e):
+    """JSON error for a refused upload request, with the offset to resume from where there is one"""
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def upload_create():
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'expected a JSON object'}), 400
+    rel_path = secure_path(str(data.get('path', '')))
+    if not rel_path or not allowed_file(rel_path):
+        return jsonify({'error': 'not a supported image file name'}), 400
+    try:
+        return jsonify(upload_sessions.create(rel_path, data.get('size'), data.get('sha256'))), 201
+    except UploadError as e:
+        return upload_error(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    try:
+        return jsonify(upload_sessions.status(upload_id))
+    except UploadError as e:
+        return upload_error(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    # Raw chunk body at ?offset=; read straight from the socket in small pieces, never parsed as a form
+    if request.content_length is None:
+        return jsonify({'error': 'Content-Length required'}), 411
+    try:
+        offset = upload_sessions.write(upload_id, int(request.args.get('offset', -1)),
+                                       request.stream, request.content_length)
+    except ValueError:
+        return jsonify({'error': 'invalid offset'}), 400
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify({'offset': offset})
+
+@app.route('/api/uploads/<upload_id>/commit', methods=['POST'])
+@login_required
+def upload_commit(upload_id):
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'expected a JSON object'}), 400
+    try:
+        part_path, rel_path = upload_sessions.commit(upload_id, data.get('sha256'))
+        # Hashing, dedup and thumbnails happen in the background, as for form uploads
+        ingest_queue().submit_file(part_path, rel_path)
+    except UploadError as e:
+        return upload_error(e)
+    except OSError:
+        return jsonify({'error': 'no such upload'}), 404
+    upload_sessions.finish(upload_id)
+    return jsonify({'ok': True, 'path': rel_path})
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def upload_abort(upload_id):
+    try:
+        upload_sessions.abort(upload_id)
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify({'ok': True})
+
+@app.route('/api/images')
+@login_required
+def api_images():
+    sort_by = request.args.get('sort', 'name')
+    try:
+        limit = min(max(int(request.args.get('limit', GALLERY_PAGE_SIZE)), 1), GALLERY_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = GALLERY_PAGE_SIZE
+    cursor = request.args.get('cursor')
+    if cursor and decode_cursor(cursor) is None:
+        return jsonify({'error': 'invalid cursor'}), 400
+    images, next_cursor = list_images(sort_by, cursor, limit)
+    return jsonify({'images': images, 'next_cursor': next_cursor, 'sort': sort_by})
+
+@app.route('/api/ingest')
+@login_required
+def ingest_status():
+    return jsonify(ingest_queue().status())
 
 @app.route('/delete/<path:filepath>')
 @login_required
@@ -276,36 +727,183 @@ def delete(filepath):
     full_path = os.path.join(IMAGE_DIR, filepath)
     if os.path.exists(full_path):
         if os.path.isdir(full_path):
+            # Cached images are keyed by source file, so collect the folder's files first
+            removed = [os.path.join(root, name) for root, _, names in os.walk(full_path) for name in names]
             shutil.rmtree(full_path)
         else:
+            removed = [full_path]
             os.remove(full_path)
+        for cache in (thumb_cache, rendition_cache, frame_renditions):
+            cache.remove_sources(removed)
     # Redirect to the parent directory
     parent_path = os.path.dirname(filepath)
     return redirect(url_for('index', current_path=parent_path) if parent_path != '.' else url_for('index'))
 
 @app.route('/image/<path:filepath>')
 def image(filepath):
-    directory = os.path.dirname(os.path.join(IMAGE_DIR, filepath))
-    filename = os.path.basename(filepath)
-    if allowed_file(filename) and os.path.exists(os.path.join(directory, filename)):
-        return send_from_directory(directory, filename)
-    return "Not allowed", 403
+    # A browser-friendly rendition (?w=<width>&fmt=jpeg|webp) by default; the original only with ?original=1
+    full_path = safe_join(IMAGE_DIR, filepath)  # None if the path escapes IMAGE_DIR
+    if full_path is None or not allowed_file(os.path.basename(filepath)) or not os.path.exists(full_path):
+        return "Not allowed", 403
+    if request.args.get('original') == '1':
+        # Absolute directory: Flask would resolve a relative one against src/, not the working
+        # directory. send_from_directory answers conditional and Range requests, and the body
+        # goes out via sendfile under gunicorn.
+        return send_from_directory(os.path.abspath(IMAGE_DIR), filepath, conditional=True)
+
+    fmt = request.args.get('fmt')
+    negotiated = fmt is None
+    if negotiated:
+        fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    if fmt not in RENDITION_FORMATS:
+        return "Unsupported format", 400
+    try:
+        width = rendition_width(int(request.args.get('w', RENDITION_DEFAULT_WIDTH)))
+    except ValueError:
+        return "Invalid width", 400
+
+    st = os.stat(full_path)
+    try:
+        path, key = ensure_rendition(full_path, filepath, st, width, fmt, wait=RENDITION_WAIT_SECONDS)
+    except Busy as e:
+        return busy_response(e)
+    except Exception as e:
+        return str(e), 500
+    response = send_file(path, mimetype=RENDITION_FORMATS[fmt][1], conditional=True,
+                         etag=key, last_modified=st.st_mtime)
+    if negotiated:
+        response.vary.add('Accept')
+    return response
 
 @app.route('/thumb/<path:filepath>')
 def thumb(filepath):
     full_path = os.path.join(IMAGE_DIR, filepath)
-    if not os.path.exists(full_path) or not allowed_file(os.path.basename(filepath)):
+    if not allowed_file(os.path.basename(filepath)):
+        return "Not found", 404
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        return "Not found", 404
+
+    try:
+        thumb_path, key = ensure_thumb(filepath, st, wait=THUMB_WAIT_SECONDS)
+    except Busy as e:
+        return busy_response(e)
+    except Exception as e:
+        return str(e), 500
+
+    # Cache hits go straight from disk; the ETag lets browsers revalidate with a 304
+    return send_file(thumb_path, mimetype='image/jpeg', conditional=True,
+                     etag=key, last_modified=st.st_mtime)
+
+def frame_authorized():
+    """Whether the request carries the frame token (or comes from a logged-in user)"""
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    return 'username' in session or secrets.compare_digest(token.encode(), frame_token().encode())
+
+@app.route('/rendition/<size>/<path:filepath>')
+def rendition(size, filepath):
+    # A registered frame's screen-sized image (?fmt= the frame's thumbnail format, default jpeg).
+    # Rendered on the spot as urgent work, unless ?ready=1 (only if already built, else 404).
+    # Urgent work holds off every background job, so only frames (and users) may ask for it.
+    if not frame_authorized():
+        return "Frame token required", 401
+    full_path = safe_join(IMAGE_DIR, filepath)
+    if full_path is None or not allowed_file(os.path.basename(filepath)) or not os.path.isfile(full_path):
         return "Not found", 404
+    fmt = request.args.get('fmt', 'jpeg')
+    try:
+        size = rendition_store.parse_size(size)
+    except ValueError:
+        return "Invalid size", 400
+    if not frame_registry.is_target(size, fmt):
+        return "No frame registered for this size and format", 404
+
+    st = os.stat(full_path)
+    if request.args.get('ready') == '1' and not os.path.exists(frame_rendition_path(filepath, st, size, fmt)):
+        return "Not rendered yet", 404
     try:
-        with Image.open(full_path) as im:
-            im.thumbnail((200, 200))
-            im = im.convert('RGB')  # Ensure RGB mode for JPEG compatibility
-            img_io = BytesIO()
-            im.save(img_io, 'JPEG', quality=85)
-            img_io.seek(0)
-            return send_file(img_io, mimetype='image/jpeg')
+        path = ensure_frame_rendition(full_path, filepath, st, size, fmt, urgent=True)
     except Exception as e:
         return str(e), 500
+    # The file name already changes with the photo's mtime, so it doubles as the ETag
+    return send_file(path, mimetype='image/jpeg' if fmt == 'jpeg' else 'application/octet-stream',
+                     conditional=True, etag=os.path.splitext(os.path.basename(path))[0],
+                     last_modified=st.st_mtime)
+
+@app.route('/api/frames/register', methods=['POST'])
+def register_frame():
+    # Frames register with the shared token (or a logged-in user does it for them):
+    # each registration means building a rendition of the whole library
+    if not frame_authorized():
+        return jsonify({'error': 'frame token required'}), 401
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'expected a JSON object'}), 400
+    fmt = str(data.get('format', 'jpeg'))
+    try:
+        size = (int(data.get('width')), int(data.get('height')))
+        frame_registry.register(str(data.get('name', '')), size, fmt)
+    except (TypeError, ValueError, rendition_store.RegistryError) as e:
+        return jsonify({'error': str(e)}), 400
+    # Catch up on photos added since the frame last registered
+    start_frame_renditions(size, fmt)
+    return jsonify({'ok': True, 'frames': frame_registry.frames()})
+
+@app.route('/api/frames')
+@login_required
+def frames():
+    return jsonify(frame_registry.frames())
+
+@app.route('/metrics')
+@login_required
+def metrics():
+    data = frame_metrics.read_metrics()
+    return render_template('metrics.html', metrics=data, work=work.status(),
+                           stale=data is not None and data['age'] > 3 * frame_metrics.PUBLISH_SECONDS)
+
+@app.route('/api/metrics')
+@login_required
+def metrics_json():
+    data = frame_metrics.read_metrics()
+    if data is None:
+        return jsonify({'error': 'no metrics published yet', 'work': work.status()}), 503
+    data['work'] = work.status()
+    return jsonify(data)
+
+@app.route('/api/frame/status')
+@login_required
+def frame_status():
+    try:
+        reply = frame_control.send_command('status')
+    except frame_control.FrameControlError as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify(reply['status'])
+
+@app.route('/api/frame/<command>', methods=['POST'])
+@login_required
+def frame_command(command):
+    if command not in frame_control.COMMANDS:
+        return jsonify({'error': f'unknown command {command}'}), 404
+    args = {}
+    if command == 'show':
+        data = request.get_json(silent=True) or request.form
+        if not isinstance(data, dict) and data is not request.form:
+            return jsonify({'error': 'expected a JSON object'}), 400
+        path = data.get('path', '')
+        if not isinstance(path, str):
+            return jsonify({'error': 'path must be a string'}), 400
+        path = path.strip('/')
+        if not path or safe_join(IMAGE_DIR, path) is None:
+            return jsonify({'error': 'no image given'}), 400
+        args['path'] = path
+    try:
+        reply = frame_control.send_command(command, **args)
+    except frame_control.FrameControlError as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify(reply['status'])
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Development server. In production run src/serve.py instead (threaded workers, sendfile).
+    # WEB_DEBUG=1 turns on the debugger and reloader - never on a frame reachable from outside.
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('WEB_DEBUG') == '1', threaded=True)
\ No newline at end of file
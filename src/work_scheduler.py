@@ -0,0 +1,239 @@
+"""Image work shared between the frame and the web manager, by priority.
+
+Both processes decode images on the same few cores. This module gives that
+work two priorities:
+
+- urgent: what the frame is about to put on screen (the current and next
+  slides). It never waits. While any urgent work runs, no background job
+  starts, in either process.
+- background: gallery thumbnails, renditions, ingest pre-renders. These
+  need one of SLOTS slots, which are shared by all processes through
+  fcntl locks on files in WORK_DIR, so one core stays free for the
+  slideshow. They run on worker threads at lowered CPU (nice) and I/O
+  (idle class) priority.
+
+A background job that can't get a slot within its `wait` raises Busy, so a
+web request can answer 503 with Retry-After instead of piling up. Each
+held slot's file names its holder, so status() in either process shows
+the whole queue.
+
+Without fcntl (Windows development) the slots are only shared within the
+process.
+"""
+import os
+import json
+import time
+import ctypes
+import platform
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from paths import CACHE_ROOT
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Lock files change on every job, so keep them in RAM where there's a tmpfs
+WORK_DIR = "/dev/shm/rpi-photo-frame-work" if os.path.isdir("/dev/shm") else os.path.join(CACHE_ROOT, "work")
+SLOTS = max(1, (os.cpu_count() or 1) - 1)   # background jobs at once, across processes
+BACKGROUND_NICE = 10
+POLL_SECONDS = 0.05       # how often a waiting job checks for a free slot
+RETRY_AFTER = 2           # seconds suggested to clients turned away with Busy
+
+# ioprio_set(2) has no Python wrapper; syscall numbers per architecture
+_IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "armv7l": 314, "armv6l": 314, "i686": 289}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+
+
+class Busy(Exception):
+    """No background slot became free in time"""
+
+    def __init__(self, retry_after=RETRY_AFTER):
+        super().__init__(f"busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def lower_priority(nice=BACKGROUND_NICE):
+    """Lower the CPU and I/O priority of the calling thread (Linux) or process; best effort"""
+    tid = threading.get_native_id() if platform.system() == "Linux" else 0
+    try:
+        # On Linux a thread id works as a "process" for setpriority
+        os.setpriority(os.PRIO_PROCESS, tid, min(19, os.getpriority(os.PRIO_PROCESS, tid) + nice))
+    except (AttributeError, OSError):
+        pass
+    number = _IOPRIO_SET.get(platform.machine())
+    if number is not None and platform.system() == "Linux":
+        try:
+            ctypes.CDLL(None, use_errno=True).syscall(number, _IOPRIO_WHO_PROCESS, tid, _IOPRIO_CLASS_IDLE << 13)
+        except (OSError, AttributeError):
+            pass
+
+
+class WorkScheduler:
+    """Runs urgent work inline and background work on niced threads, one shared slot each"""
+
+    def __init__(self, work_dir=WORK_DIR, slots=SLOTS):
+        self.work_dir = work_dir
+        self.slots = slots
+        self._pool = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="background-work",
+                                        initializer=lower_priority)
+        self._lock = threading.Lock()
+        self._local_slots = set()   # slot numbers held by this process (used without fcntl)
+        self._urgent = 0            # urgent jobs running in this process
+        self.waiting = 0
+        self.counts = {"urgent_jobs": 0, "background_jobs": 0, "busy": 0}
+        os.makedirs(work_dir, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    # ---------------------- urgent work ----------------------
+
+    def urgent(self):
+        """Context manager around frame-visible work; holds off background jobs while it runs"""
+        return _Urgent(self)
+
+    def urgent_active(self):
+        if self._urgent:
+            return True
+        if fcntl is None:
+            return False
+        # Urgent work holds a shared lock; an exclusive probe fails while any is held
+        # (or, briefly, while another process probes too, which just costs one poll)
+        fd = os.open(self._path("urgent.lock"), os.O_RDWR | os.O_CREAT, 0o660)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except OSError:
+            return True
+        finally:
+            os.close(fd)  # also drops the probe's lock
+
+    # ---------------------- background work ----------------------
+
+    def run(self, fn, *args, wait=None, label=None):
+        """Run fn(*args) as background work on a low-priority thread and return its result.
+
+        Waits up to `wait` seconds (None: for as long as it takes) for urgent
+        work to finish and a slot to free up, then raises Busy.
+        """
+        with self.background(wait, label or getattr(fn, "__name__", "job")):
+            return self._pool.submit(fn, *args).result()
+
+    @contextmanager
+    def background(self, wait=None, label="job"):
+        """Hold a background slot around work already running at low priority (e.g. a niced worker process)"""
+        deadline = None if wait is None else time.monotonic() + wait
+        with self._lock:
+            self.waiting += 1
+        try:
+            slot = self._acquire(deadline, label)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        try:
+            with self._lock:
+                self.counts["background_jobs"] += 1
+            yield
+        finally:
+            self._release(slot)
+
+    def _acquire(self, deadline, label):
+        while True:
+            if not self.urgent_active():
+                for number in range(self.slots):
+                    slot = self._try_slot(number, label)
+                    if slot is not None:
+                        return slot
+            if deadline is not None and time.monotonic() >= deadline:
+                with self._lock:
+                    self.counts["busy"] += 1
+                raise Busy()
+            time.sleep(POLL_SECONDS)
+
+    def _try_slot(self, number, label):
+        with self._lock:
+            if number in self._local_slots:
+                return None
+            self._local_slots.add(number)
+        if fcntl is None:
+            return (number, None)
+        fd = os.open(self._path(f"slot-{number}.lock"), os.O_RDWR | os.O_CREAT, 0o660)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            with self._lock:
+                self._local_slots.discard(number)
+            return None
+        # Name the holder for status() in other processes
+        holder = json.dumps({"pid": os.getpid(), "job": label, "since": time.time()}).encode("utf-8")
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, holder, 0)
+        return (number, fd)
+
+    def _release(self, slot):
+        number, fd = slot
+        if fd is not None:
+            os.close(fd)
+        with self._lock:
+            self._local_slots.discard(number)
+
+    # ---------------------- status ----------------------
+
+    def status(self):
+        """Slots in use across processes, and this process's own counters"""
+        running = []
+        for number in range(self.slots):
+            path = self._path(f"slot-{number}.lock")
+            if fcntl is None:
+                if number in self._local_slots:
+                    running.append({"pid": os.getpid()})
+                continue
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except OSError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError:
+                # Held: report who holds it
+                try:
+                    running.append(json.loads(os.pread(fd, 4096, 0) or b"{}"))
+                except ValueError:
+                    running.append({})
+            finally:
+                os.close(fd)
+        with self._lock:
+            return {"slots": self.slots, "running": running, "waiting": self.waiting,
+                    "urgent": self.urgent_active(), **self.counts}
+
+
+class _Urgent:
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._fd = None
+
+    def __enter__(self):
+        s = self.scheduler
+        with s._lock:
+            s._urgent += 1
+            s.counts["urgent_jobs"] += 1
+        if fcntl is not None:
+            self._fd = os.open(s._path("urgent.lock"), os.O_RDWR | os.O_CREAT, 0o660)
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            os.close(self._fd)
+        with self.scheduler._lock:
+            self.scheduler._urgent -= 1
+        return False
+
+
+# Shared instance for each process
+work = WorkScheduler()